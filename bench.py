@@ -1,12 +1,249 @@
 #!/usr/bin/env python3
+""" Stop watch, running averages, streaming statistics and
+    a benchmark harness.
+
+    suite = Suite("sorting")
+    suite.add("sorted 1k", sorted, setup=lambda: (random_list(1000),))
+    suite.main()    # -h for options: JSON output, baseline, isolation
+"""
+from itertools import repeat as _repeat
+from numbers import Real
+import multiprocessing
+import platform
+import math
+import json
 import time
+import gc
+import sys
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+CLOCKS = {"wall": time.perf_counter_ns, "cpu": time.process_time_ns}
+Z95 = 1.96  # normal quantile for 95% confidence intervals
+
+
+class Moments:
+  """ Count, mean, variance (Welford), min and max of a stream of
+      samples of `dimension` values, in constant memory.
+  """
+  def __init__(self, dimension):
+    self.dimension = dimension
+    self.count = 0
+    self.mean = [0.0] * dimension
+    self.m2 = [0.0] * dimension   # sum of squared deviations from the mean
+    self.min = [math.inf] * dimension
+    self.max = [-math.inf] * dimension
+
+  def append(self, item):
+    self.count += 1
+    n = self.count
+    mean, m2, lo, hi = self.mean, self.m2, self.min, self.max
+    for i, x in enumerate(item):
+      delta = x - mean[i]
+      mean[i] += delta / n
+      m2[i] += delta * (x - mean[i])
+      if x < lo[i]:
+        lo[i] = x
+      if x > hi[i]:
+        hi[i] = x
+
+  def combine(self, count, mean, m2, lo, hi):
+    """ Add statistics of another set of samples (Chan et al.). """
+    if not count:
+      return
+    total = self.count + count
+    for i in range(self.dimension):
+      delta = mean[i] - self.mean[i]
+      self.mean[i] += delta * count / total
+      self.m2[i] += m2[i] + delta * delta * self.count * count / total
+      self.min[i] = min(self.min[i], lo[i])
+      self.max[i] = max(self.max[i], hi[i])
+    self.count = total
+
+  def extend(self, rows):
+    """ rows: numpy array count x dimension. """
+    if not len(rows):
+      return
+    mean = rows.mean(axis=0)
+    self.combine(len(rows), mean.tolist(),
+                 ((rows - mean) ** 2).sum(axis=0).tolist(),
+                 rows.min(axis=0).tolist(), rows.max(axis=0).tolist())
+
+  def merge(self, other):
+    assert self.dimension == other.dimension
+    self.combine(other.count, other.mean, other.m2, other.min, other.max)
+
+  def variance(self):
+    if self.count < 2:
+      return [0.0] * self.dimension
+    return [m2 / (self.count - 1) for m2 in self.m2]
+
+  def stddev(self):
+    return [math.sqrt(v) for v in self.variance()]
+
+
+class Histogram:
+  """ Log-bucketed histogram of non-negative values, HDR style: any
+      percentile comes out within `precision` (relative) of the true
+      value. Memory depends on the range of values, not on how many.
+  """
+  def __init__(self, precision=0.01):
+    self.precision = precision
+    self.base = 1 + 2 * precision
+    self.scale = 1 / math.log(self.base)
+    self.buckets = {}  # i -> count of values in [base**i, base**(i+1))
+    self.zero = 0      # values <= 0
+    self.count = 0
+
+  def append(self, x):
+    self.count += 1
+    if x <= 0:
+      self.zero += 1
+      return
+    i = math.floor(math.log(x) * self.scale)
+    self.buckets[i] = self.buckets.get(i, 0) + 1
+
+  def extend(self, values):
+    """ values: 1-d numpy array. """
+    self.count += len(values)
+    positive = values[values > 0]
+    self.zero += len(values) - len(positive)
+    index, counts = np.unique(np.floor(np.log(positive) * self.scale)
+                              .astype(np.int64), return_counts=True)
+    buckets = self.buckets
+    for i, c in zip(index.tolist(), counts.tolist()):
+      buckets[i] = buckets.get(i, 0) + c
+
+  def merge(self, other):
+    assert self.precision == other.precision
+    self.count += other.count
+    self.zero += other.zero
+    for i, c in other.buckets.items():
+      self.buckets[i] = self.buckets.get(i, 0) + c
+
+  def percentile(self, p):
+    """ Value below which p percent of values are, None if empty. """
+    if not self.count:
+      return None
+    rank = max(1, math.ceil(self.count * p / 100))
+    seen = self.zero
+    if seen >= rank:
+      return 0.0
+    for i in sorted(self.buckets):
+      seen += self.buckets[i]
+      if seen >= rank:
+        return (self.base ** i + self.base ** (i + 1)) / 2
+    return self.base ** max(self.buckets)
+
+
+class Stream:
+  """ Streaming statistics of samples with one or more values (same
+      number in every sample): Moments and a Histogram per value.
+
+      Memory does not grow with the number of samples. extend() takes
+      many samples at once, vectorized when numpy is there. Streams
+      filled in other threads or processes (they pickle) can be
+      merged into one.
+  """
+  def __init__(self, dimension=None, precision=0.01):
+    self.dimension = dimension
+    self.precision = precision
+    self.moments = None
+    self.histograms = None
+    if dimension:
+      self.setup(dimension)
+
+  def setup(self, dimension):
+    self.dimension = dimension
+    self.moments = Moments(dimension)
+    self.histograms = [Histogram(self.precision) for _ in range(dimension)]
+
+  def append(self, item):
+    if not self.moments:
+      self.setup(len(item))
+    assert self.dimension == len(item)
+    self.moments.append(item)
+    for histogram, x in zip(self.histograms, item):
+      histogram.append(x)
+
+  def extend(self, items):
+    """ Add many samples: sequence of samples, or a numpy array
+        of shape (count, dimension) or (count,) for one value.
+    """
+    if np is None:
+      for item in items:
+        self.append([item] if isinstance(item, Real) else item)
+      return
+    rows = np.asarray(items, dtype=float)
+    if not rows.size:
+      return
+    if rows.ndim == 1:
+      rows = rows.reshape(-1, 1)
+    if not self.moments:
+      self.setup(rows.shape[1])
+    assert self.dimension == rows.shape[1]
+    self.moments.extend(rows)
+    for i, histogram in enumerate(self.histograms):
+      histogram.extend(rows[:, i])
+
+  def merge(self, other):
+    if not other.moments:
+      return
+    if not self.moments:
+      self.setup(other.dimension)
+    self.moments.merge(other.moments)
+    for mine, theirs in zip(self.histograms, other.histograms):
+      mine.merge(theirs)
+
+  @property
+  def count(self):
+    return self.moments.count if self.moments else 0
+
+  def nothing(self):
+    """ What statistics of an empty stream are: None for every value. """
+    return [None] * (self.dimension or 0)
+
+  def mean(self):
+    return list(self.moments.mean) if self.count else self.nothing()
+
+  def stddev(self):
+    return self.moments.stddev() if self.count else self.nothing()
+
+  def percentile(self, p):
+    """ p-th percentile of every value, within precision. """
+    if not self.count:
+      return self.nothing()
+    m = self.moments
+    return [min(max(h.percentile(p), lo), hi) for h, lo, hi
+            in zip(self.histograms, m.min, m.max)]
+
+  def summary(self):
+    """ Like summary() of stored samples, for every value. None
+        for every value of an empty stream.
+    """
+    m = self.moments
+    lo, hi = (list(m.min), list(m.max)) if self.count \
+             else (self.nothing(), self.nothing())
+    return dict(n=self.count, min=lo, mean=self.mean(),
+                stddev=self.stddev(), median=self.percentile(50),
+                p95=self.percentile(95), p99=self.percentile(99),
+                p999=self.percentile(99.9), max=hi)
+
 
 class Avg:
-  def __init__(self, report=10, verbose=True, dimension=None):
-    self.container = []
+  """ Prints the mean of every `report` samples. All samples also go
+      to self.stats, a Stream, for percentiles of the whole run.
+  """
+  def __init__(self, report=10, verbose=True, dimension=None,
+               precision=0.01):
     self.report = report
     self.verbose = False
     self.dimension = dimension
+    self.window = Moments(dimension) if dimension else None
+    self.stats = Stream(dimension, precision)
 
   def append(self, item):
     if self.verbose:
@@ -16,30 +253,25 @@ class Avg:
        assert self.dimension == len(item)
     else:
       self.dimension = len(item)
+      self.window = Moments(self.dimension)
 
-    self.container.append(item)
+    self.window.append(item)
+    self.stats.append(item)
 
-    if self.report and len(self.container) == self.report:
+    if self.report and self.window.count == self.report:
       self.calc()
-      self.container = []
+      self.window = Moments(self.dimension)
 
   def calc(self):
-    result = []
-    data_dim = len(self.container[0])
-    data_len = len(self.container)
-
-    for i in range(data_dim):
-      sum = 0
-      for items in self.container:
-        sum += items[i]
-      #result.append(round(sum/data_len, 2))
-      result.append(sum/data_len)
+    result = list(self.window.mean)
     if self.verbose:
-      print("avg for last {0} values: {1}".format(data_len, ["{0:.2f}".format(r) for r in result]))
+      print("avg for last {0} values: {1}".format(
+        self.window.count, ["{0:.2f}".format(r) for r in result]))
     return result
 
 
 class StopWatch:
+  """ Wall and CPU time of a block, in seconds. """
   def __init__(self):
     self.started = False
     self.cpu     = None
@@ -48,14 +280,14 @@ class StopWatch:
   def start(self):
     assert not self.started
     self.started = True
-    self.cpu  = -time.clock()
-    self.time = -time.time()
+    self.cpu  = -time.process_time_ns()
+    self.time = -time.perf_counter_ns()
 
   def stop(self):
     assert self.started
     self.started = False
-    self.cpu  += time.clock()
-    self.time += time.time()
+    self.time = (self.time + time.perf_counter_ns()) / 1e9
+    self.cpu  = (self.cpu + time.process_time_ns()) / 1e9
     return(self.cpu, self.time)
 
   def __enter__(self):
@@ -69,20 +301,248 @@ class StopWatch:
     return "StopWatch(wall={wall},cpu={cpu})".format(wall=self.time, cpu=self.cpu)
 
 
+def percentile(ordered, p):
+  """ p-th percentile of sorted samples, linear interpolation. """
+  pos = (len(ordered) - 1) * p / 100
+  lo = int(pos)
+  hi = min(lo + 1, len(ordered) - 1)
+  return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summary(samples):
+  """ Statistics of samples: min, median, p95, p99, max, mean, stddev,
+      and 95% confidence intervals of the mean and of the median.
+  """
+  ordered = sorted(samples)
+  n = len(ordered)
+  mean = sum(ordered) / n
+  stddev = math.sqrt(sum((x - mean) ** 2 for x in ordered) / (n - 1)) \
+           if n > 1 else 0.0
+  err = Z95 * stddev / math.sqrt(n)
+  # ranks around the median that hold it with 95% confidence
+  half = Z95 * math.sqrt(n) / 2
+  lo = max(0, math.floor(n / 2 - half))
+  hi = min(n - 1, math.ceil(n / 2 + half) - 1)
+  return dict(n=n, min=ordered[0], median=percentile(ordered, 50),
+              p95=percentile(ordered, 95), p99=percentile(ordered, 99),
+              max=ordered[-1], mean=mean, stddev=stddev,
+              mean_ci=[mean - err, mean + err],
+              median_ci=[ordered[lo], ordered[hi]])
+
+
+class Benchmark:
+  """ Times func(*setup()) in loops of `number` calls.
+
+      number is calibrated when not given: doubled until one loop takes
+      at least min_time seconds. `warmup` loops run before measuring.
+      With gc=False the garbage collector is off while measuring.
+      Samples are nanoseconds per call on the clock ("wall" or "cpu").
+  """
+  def __init__(self, name, func, setup=None, number=None, repeat=20,
+               warmup=1, min_time=0.01, gc=False, clock="wall"):
+    assert clock in CLOCKS, "unknown clock %s" % clock
+    self.name = name
+    self.func = func
+    self.setup = setup
+    self.number = number
+    self.repeat = repeat
+    self.warmup = warmup
+    self.min_time = min_time
+    self.gc = gc
+    self.clock = clock
+
+  def loop(self, args, number):
+    """ ns that number calls took. """
+    func, clock = self.func, CLOCKS[self.clock]
+    it = _repeat(None, number)
+    start = clock()
+    for _ in it:
+      func(*args)
+    return clock() - start
+
+  def calibrate(self, args):
+    number = 1
+    while True:
+      if self.loop(args, number) >= self.min_time * 1e9 or number >= 1 << 30:
+        return number
+      number *= 2
+
+  def run(self, args, number):
+    """ Samples, ns per call. """
+    for _ in range(self.warmup):
+      self.loop(args, number)
+    enabled = gc.isenabled()
+    if not self.gc:
+      gc.collect()
+      gc.disable()
+    try:
+      return [self.loop(args, number) / number for _ in range(self.repeat)]
+    finally:
+      if enabled:
+        gc.enable()
+
+  def measure(self):
+    """ summary() of a run, with the loop size and the samples. """
+    args = tuple(self.setup()) if self.setup else ()
+    number = self.number if self.number else self.calibrate(args)
+    samples = self.run(args, number)
+    result = summary(samples)
+    result.update(clock=self.clock, number=number, samples=samples)
+    return result
+
+
+def _isolated(conn, bench):
+  conn.send(bench.measure())
+  conn.close()
+
+
+class Suite:
+  """ Named benchmarks that run together, save their results to JSON
+      and compare them with a baseline.
+
+      With isolate=True every benchmark runs in a process of its own,
+      by default forked, so it does not see the heap and caches the
+      others left behind. A "spawn" context needs picklable functions.
+  """
+  def __init__(self, name, isolate=False, context=None, **defaults):
+    self.name = name
+    self.isolate = isolate
+    self.context = context
+    self.defaults = defaults  # Benchmark options for every benchmark
+    self.benchmarks = {}
+
+  def add(self, name, func, setup=None, **opts):
+    self.benchmarks[name] = Benchmark(name, func, setup,
+                                      **dict(self.defaults, **opts))
+
+  def bench(self, name=None, setup=None, **opts):
+    """ Decorator version of add(). """
+    def wrap(func):
+      self.add(name if name else func.__name__, func, setup, **opts)
+      return func
+    return wrap
+
+  def measure(self, bench):
+    if not self.isolate:
+      return bench.measure()
+    context = self.context
+    if not context:
+      forks = "fork" in multiprocessing.get_all_start_methods()
+      context = multiprocessing.get_context("fork" if forks else None)
+    reader, writer = context.Pipe(duplex=False)
+    proc = context.Process(target=_isolated, args=(writer, bench))
+    proc.start()
+    writer.close()
+    try:
+      return reader.recv()
+    finally:
+      proc.join()
+
+  def run(self, names=None, verbose=False):
+    """ Results of benchmarks (all by default), ready for save(). """
+    results = {}
+    for name, bench in self.benchmarks.items():
+      if names and name not in names:
+        continue
+      results[name] = self.measure(bench)
+      if verbose:
+        print(format_result(name, results[name]), file=sys.stderr)
+    return dict(suite=self.name, time=time.time(),
+                python=platform.python_version(),
+                machine=platform.machine(), results=results)
+
+  def main(self, argv=None):
+    """ Command line: run, print, save, compare. Exit status 1
+        when something regressed.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Run %s benchmarks."
+                                                 % self.name)
+    parser.add_argument('names', nargs='*', help="benchmarks to run")
+    parser.add_argument('-o', '--json', help="save results to file")
+    parser.add_argument('-b', '--baseline', help="compare with results file")
+    parser.add_argument('-t', '--threshold', type=float, default=0.05,
+                        help="slowdown that counts as regression")
+    parser.add_argument('-i', '--isolate', action='store_true',
+                        help="one process per benchmark")
+    parser.add_argument('-l', '--list', action='store_true',
+                        help="list benchmarks")
+    args = parser.parse_args(argv)
+    if args.list:
+      print("\n".join(self.benchmarks))
+      return
+    self.isolate = self.isolate or args.isolate
+    report = self.run(args.names, verbose=True)
+    if args.json:
+      save(report, args.json)
+    if args.baseline:
+      changes = compare(report, load(args.baseline), args.threshold)
+      for change in changes:
+        print(format_change(change))
+      if any(c["verdict"] == "slower" for c in changes):
+        sys.exit(1)
+
+
+def save(report, path):
+  with open(path, "w") as f:
+    json.dump(report, f, indent=1)
+
+
+def load(path):
+  with open(path) as f:
+    return json.load(f)
+
+
+def compare(report, baseline, threshold=0.05):
+  """ Benchmarks in both: "slower" or "faster" when the median moved
+      by more than threshold and the median confidence intervals do
+      not overlap, "same" otherwise.
+  """
+  changes = []
+  old_results = baseline["results"]
+  for name, new in report["results"].items():
+    old = old_results.get(name)
+    if not old:
+      continue
+    ratio = new["median"] / old["median"] if old["median"] else float('inf')
+    verdict = "same"
+    if ratio > 1 + threshold and new["median_ci"][0] > old["median_ci"][1]:
+      verdict = "slower"
+    elif ratio < 1 - threshold and new["median_ci"][1] < old["median_ci"][0]:
+      verdict = "faster"
+    changes.append(dict(name=name, old=old["median"], new=new["median"],
+                        ratio=ratio, verdict=verdict))
+  return changes
+
+
+def fmt_ns(ns):
+  for unit, scale in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+    if ns >= scale:
+      return "%.2f%s" % (ns / scale, unit)
+  return "%.1fns" % ns
+
+
+def format_result(name, r):
+  lo, hi = r["median_ci"]
+  return "{:<24} median {} [{} .. {}]  min {}  p95 {}  p99 {}  " \
+         "sd {}".format(name, fmt_ns(r["median"]), fmt_ns(lo), fmt_ns(hi),
+                        fmt_ns(r["min"]), fmt_ns(r["p95"]), fmt_ns(r["p99"]),
+                        fmt_ns(r["stddev"]))
+
+
+def format_change(c):
+  return "{:<24} {:>10} -> {:>10}  {:+6.1%}  {}".format(
+    c["name"], fmt_ns(c["old"]), fmt_ns(c["new"]), c["ratio"] - 1,
+    c["verdict"])
+
+
 if __name__ == '__main__':
   import numpy as np
-  import gc; gc.disable()
-
-  size = 64
-  repeats = 10
-  for x in range(4):
-    A=np.random.randn(size, size)
-    B=np.random.randn(size, size)
-    avg = Avg(report=repeats)
-    print("for matrix {0}x{0}....".format(size))
-    for y in range(repeats):
-      with StopWatch() as t:
-        np.dot(A, B)
-      print("Matrices {0}x{0}: real: {1:.2f} cpu: {2:.2f}".format(size, t.time, t.cpu))
-      avg.append([t.time])
-    size += 128
+
+  def matrices(size):
+    return lambda: (np.random.randn(size, size), np.random.randn(size, size))
+
+  suite = Suite("matrix", repeat=10)
+  for size in range(64, 64 + 4*128, 128):
+    suite.add("dot {0}x{0}".format(size), np.dot, setup=matrices(size))
+  suite.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+""" Rendering benchmarks for libgui.
+
+    Everything is drawn on a vterm.VirtualTerminal, so no TTY is needed
+    and the cost of output is measured exactly: bytes and write() calls
+    that reach the terminal and the wall time to produce them.
+"""
+import threading
+import time
+import sys
+
+from useful.libgui import XY, Rect, Widget, Scheduler, Canvas, BufferedCanvas,  \
+    Border, VList, String, Bars, Bar, Text, Chart, horiz
+from useful.vterm import VirtualTerminal
+
+# functions that create geometry objects
+CREATORS = {'__new__', '__init__', '__add__', '__sub__', '__or__', '__and__'}
+CREATOR_CODES = {vars(cls)[name].__code__ for cls in (XY, Rect)
+                 for name in CREATORS
+                 if hasattr(vars(cls).get(name), '__code__')}
+
+
+def is_creator(frame):
+  # namedtuple's __new__ is compiled in a namespace of its own
+  if frame.f_globals.get('__name__') in ('namedtuple_XY', 'namedtuple_Rect'):
+    return True
+  return frame.f_code in CREATOR_CODES
+
+
+def count_geometry(f):
+  """ Call f, return number of XY and Rect objects it created. """
+  created = 0
+  def profile(frame, event, arg):
+    nonlocal created
+    # nested calls (e.g. __add__ calling __init__) make one object
+    if event == 'call' and is_creator(frame) \
+        and not is_creator(frame.f_back):
+      created += 1
+  sys.setprofile(profile)
+  try:
+    f()
+  finally:
+    sys.setprofile(None)
+  return created
+
+
+class Frames(Scheduler):
+  """ Scheduler without a loop, benchmark calls frame() itself. """
+  def __init__(self, root):
+    self.root = root
+    self.interval = 0
+    self.last = 0
+    self.pending = False
+    self.resized = False
+    self.lock = threading.Lock()
+
+  def notify(self):
+    pass
+
+  def close(self):
+    pass
+
+
+def dashboard():
+  """ Typical tree: bars, a bar chart and a log window. """
+  text = Text()
+  for i in range(500):
+    text.println("line %d " % i * 10)
+  bars = [Bar(i/10) for i in range(10)]
+  return Border(VList(Bars([1, 2, 3, 4, 5]), *bars, Border(text)),
+                label="bench")
+
+
+def bars():
+  root = VList(*[Bar(i/40, id="bar%d" % i) for i in range(40)])
+  def run(frames):
+    for frame in range(frames.count):
+      for i in range(40):
+        root["bar%d" % i].update((i + frame) % 40 / 40)
+      frames.frame()
+  return root, run
+
+
+def text():
+  log = Text(history=100000)
+  root = Border(log, label="log")
+  def run(frames):
+    for frame in range(frames.count):
+      for i in range(50):
+        log.println("frame %d line %d " % (frame, i) * (i % 4 + 1))
+      frames.frame()
+  return root, run
+
+
+def borders():
+  root = String("nested", stretch=horiz)
+  for i in range(10):
+    root = Border(root, label="level %d" % i)
+  def run(frames):
+    for frame in range(frames.count):
+      root.invalidate()
+      frames.frame()
+  return root, run
+
+
+def chart():
+  """ Live latency: 10k samples, 200 new ones per frame. """
+  samples = [(i * 7919 % 1000) / 10 for i in range(10000)]
+  block = Chart(samples, height=8)
+  braille = Chart(samples, height=8, style="braille")
+  root = VList(block, braille)
+  def run(frames):
+    for frame in range(frames.count):
+      new = samples[frame*200 % 10000:][:200]
+      block.extend(new)
+      braille.extend(new)
+      frames.frame()
+  return root, run
+
+
+def resize():
+  root = VList(Bars([1, 2, 3, 4, 5]), Border(dashboard()))
+  def run(frames):
+    term = root.canvas.term
+    for frame in range(frames.count):
+      term.resize(200 - frame % 2 * 40, 60 - frame % 2 * 10)
+      root.on_resize()
+  return root, run
+
+
+SCENARIOS = [bars, text, borders, chart, resize]
+
+
+def measure(scenario, buffered, size=XY(200, 60), count=50):
+  """ Run scenario, return its numbers and the final screen. """
+  Widget.all_ids.clear()
+  Widget.focus_order.clear()
+  term = VirtualTerminal(*size)
+  screen = term.stream
+  canvas = BufferedCanvas(term=term) if buffered else Canvas(term=term)
+  frames = Widget.scheduler = Frames(None)
+  frames.count = count
+  try:
+    root, run = scenario()
+    frames.root = root
+    root.initroot(canvas)
+    screen.reset_stats()
+    start = time.perf_counter()
+    run(frames)
+    elapsed = time.perf_counter() - start
+  finally:
+    Widget.scheduler = None
+  result = dict(scenario=scenario.__name__, buffered=buffered,
+                bytes=screen.bytes, writes=screen.writes, time=elapsed)
+  return result, screen.text()
+
+
+def suite(scenarios=SCENARIOS, **kwargs):
+  """ Run every scenario on both canvases.
+      Also checks that both of them produce the same picture.
+  """
+  results = []
+  for scenario in scenarios:
+    direct, direct_screen = measure(scenario, False, **kwargs)
+    buffered, buffered_screen = measure(scenario, True, **kwargs)
+    same = direct_screen == buffered_screen
+    direct['same'] = buffered['same'] = same
+    results += [direct, buffered]
+  return results
+
+
+# geometry objects per full frame_geometry() draw while XY was a plain
+# class and every +, - and XY(...) made one, counted the same way on the
+# libgui of that time
+BASELINE_GEOMETRY = 1173
+
+
+def frame_geometry(frames=200):
+  """ Geometry objects and time per full frame draw. """
+  term = VirtualTerminal(200, 60)
+  Widget.scheduler = Frames(None)
+  try:
+    root = dashboard()
+    root.initroot(BufferedCanvas(term=term))
+  finally:
+    Widget.scheduler = None
+  objects = count_geometry(root.draw)
+  start = time.perf_counter()
+  for _ in range(frames):
+    root.draw()
+  elapsed = (time.perf_counter() - start) / frames
+  return objects, elapsed
+
+
+if __name__ == '__main__':
+  fmt = "{scenario:<10} {canvas:<9} {bytes:>10} {writes:>8} {ms:>9} {same}"
+  print(fmt.format(scenario="scenario", canvas="canvas", bytes="bytes",
+                   writes="writes", ms="ms", same="same picture"))
+  for r in suite():
+    print(fmt.format(canvas="buffered" if r['buffered'] else "direct",
+                     ms="%.1f" % (r['time']*1000), **r))
+  objects, elapsed = frame_geometry()
+  print("full frame: {} geometry objects (was {}), {:.0f}us"
+        .format(objects, BASELINE_GEOMETRY, elapsed*1e6))
@@ -1,45 +1,353 @@
 #!/usr/bin/env python3
 from .log import Log
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import itertools
+import threading
+import atexit
+import asyncio
+import inspect
+import heapq
+import time
+import re
 
+SYNC = "sync"        # handlers run one by one in the caller's thread
+THREAD = "thread"    # handlers are submitted to a thread pool
+PROCESS = "process"  # handlers are submitted to a process pool
+ASYNC = "async"      # handlers run concurrently in an event loop
 
-class Hook:
-  """ Simple callback dispatcher. """
+MAXROUTES = 100000   # routing table is reset when it grows beyond
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def shared_executor(mode):
+  """ Pool shared by all hooks of the mode, created on first use. """
+  with _executors_lock:
+    if mode not in _executors:
+      cls = ThreadPoolExecutor if mode == THREAD else ProcessPoolExecutor
+      _executors[mode] = cls()
+    return _executors[mode]
+
+
+class Watchdog:
+  """ Calls on_timeout(future) for futures that are not done by
+      their deadline. One thread serves all hooks.
+  """
   def __init__(self):
+    self.heap = []
+    self.counter = itertools.count()  # tie breaker for equal deadlines
+    self.cond = threading.Condition()
+    self.thread = None
+
+  def watch(self, future, timeout, on_timeout):
+    with self.cond:
+      entry = (time.monotonic() + timeout, next(self.counter),
+               future, on_timeout)
+      heapq.heappush(self.heap, entry)
+      if not self.thread:
+        self.thread = threading.Thread(target=self.run, name="hook watchdog",
+                                       daemon=True)
+        self.thread.start()
+      if self.heap[0] is entry:
+        self.cond.notify()
+
+  def run(self):
+    while True:
+      with self.cond:
+        while not self.heap or self.heap[0][0] > time.monotonic():
+          timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+          self.cond.wait(timeout)
+        _, _, future, on_timeout = heapq.heappop(self.heap)
+      if not future.done():
+        future.cancel()  # works only if it has not started yet
+        on_timeout(future)
+
+watchdog = Watchdog()
+
+
+class Predicate:
+  """ Subscription to every event for which f(event) is true:
+      hook.register(Predicate(lambda ev: ev.endswith("error")), cb)
+  """
+  def __init__(self, f):
+    self.match = f
+
+  def __repr__(self):
+    return "Predicate(%r)" % self.match
+
+
+def compile_pattern(pattern):
+  """ Matcher for dotted event names: "*" is one name, "db*" is a name
+      starting with db, "**" is any number of names, including none.
+  """
+  if pattern == '**':
+    return lambda event: isinstance(event, str)
+  regex, first = '', True
+  for part in pattern.split('.'):
+    if part == '**':
+      regex += r'(?:[^.]+\.)*' if first else r'(?:\.[^.]+)*'
+      continue
+    part = re.escape(part).replace(r'\*', '[^.]*')
+    regex += part if first else r'\.' + part
+    first = False
+  fullmatch = re.compile(regex).fullmatch
+  return lambda event: isinstance(event, str) and bool(fullmatch(event))
+
+
+def payload(args):
+  """ What fire(event, *args) hands to batch handlers. """
+  return args[0] if len(args) == 1 else args
+
+
+def is_pattern(event):
+  return isinstance(event, Predicate) or \
+         isinstance(event, str) and '*' in event
+
+
+class Hook:
+  """ Simple callback dispatcher.
+
+      mode tells how fire() runs handlers: SYNC (one by one, returns
+      None), THREAD or PROCESS (returns futures, one per handler) or
+      ASYNC (handlers may be "async def", they run concurrently,
+      returns a task). Handlers that take longer than their timeout
+      and handlers that fail are reported through self.log.error.
+
+      Events without handlers are dropped silently.
+
+      Handlers can subscribe to a pattern ("db.*", "db.**") or to a
+      Predicate. Handlers of every event name are looked up once and
+      kept in a routing table: exact ones first, then pattern ones in
+      order of registration. register() and unregister() reset it.
+  """
+  def __init__(self, mode=SYNC, executor=None, timeout=None, loop=None):
+    assert mode in (SYNC, THREAD, PROCESS, ASYNC), "unknown mode %s" % mode
     self.cb_map = defaultdict(list)
+    self.patterns = {}  # pattern -> matcher, handlers are in cb_map
+    self.routes = {}    # event -> tuple of handlers
+    self.timeouts = {}  # handler -> timeout, overrides self.timeout
+    self.batched = set()  # handlers that take lists of payloads
     self.log = Log("hook")
+    self.mode = mode
+    self.timeout = timeout
+    self.loop = loop    # for ASYNC fire() from other threads
+    if mode in (THREAD, PROCESS) and not executor:
+      executor = shared_executor(mode)
+    self.executor = executor
 
-  def decor(self, event):
+  def decor(self, event, timeout=None, batch=False):
     def wrap(cb):
-      self.register(event, cb)
+      self.register(event, cb, timeout, batch)
       return cb
     return wrap
   __call__ = decor
 
-  def register(self, event, cb):
+  def register(self, event, cb, timeout=None, batch=False):
+    """ With batch=True cb is called as cb(event, payloads)
+        with a list of payloads, see fire_many().
+    """
+    if is_pattern(event) and event not in self.patterns:
+      self.patterns[event] = event.match if isinstance(event, Predicate) \
+                             else compile_pattern(event)
     self.cb_map[event].append(cb)
+    if timeout:
+      self.timeouts[cb] = timeout
+    if batch:
+      self.batched.add(cb)
+    self.routes = {}
   add = register
 
   def unregister(self, event, cb):
     self.cb_map[event].remove(cb)
+    if not self.cb_map[event]:
+      del self.cb_map[event]
+      self.patterns.pop(event, None)
+    self.routes = {}
   rm = unregister
 
+  def route(self, event):
+    """ Handlers of event. """
+    routes = self.routes
+    try:
+      return routes[event]
+    except KeyError:
+      pass
+    handlers = [] if event in self.patterns else \
+               list(self.cb_map.get(event, ()))
+    for pattern, match in self.patterns.items():
+      if match(event):
+        handlers.extend(self.cb_map[pattern])
+    if len(routes) >= MAXROUTES:
+      routes.clear()
+    routes[event] = handlers = tuple(handlers)
+    return handlers
+
   def has_hook(self, event):
-    return event in self.cb_map
+    return bool(self.route(event))
+
+  def error(self, event, handler, err):
+    msg="error on event {ev}: {err} ({typ}) (in {hdl})" \
+            .format(err=err, typ=type(err), ev=event, hdl=handler)
+    self.log.error(msg)
+
+  def timed_out(self, event, handler, timeout):
+    self.error(event, handler, TimeoutError("timeout %ss" % timeout))
 
   def fire(self, event, *args, **kwargs):
-    if event not in self.cb_map:
-       self.log.notice("no handler for {}".format(event))
-       return
+    handlers = self.route(event)
+    if not handlers:
+      return  # nobody listens
+
+    if self.mode == SYNC:
+      batched, call = self.batched, self.call
+      for handler in handlers:
+        if handler in batched:
+          call(handler, event, ([payload(args)],), {})
+        else:
+          call(handler, event, args, kwargs)
+      return
+    return self.dispatch(event, self.calls(handlers, args, kwargs))
 
-    handlers = self.cb_map[event]
+  def fire_many(self, event, payloads):
+    """ Fire event once per payload. Batch handlers get all payloads
+        in one call, others are called with each payload.
+    """
+    handlers = self.route(event)
+    if not handlers:
+      return
+    payloads = list(payloads)
+    calls = []
     for handler in handlers:
+      if handler in self.batched:
+        calls.append((handler, (payloads,), {}))
+      else:
+        calls.extend((handler, (p,), {}) for p in payloads)
+    return self.dispatch(event, calls)
+
+  def calls(self, handlers, args, kwargs):
+    """ (handler, args, kwargs) to fire an event once. """
+    batch = ([payload(args)],)
+    return [(handler, batch, {}) if handler in self.batched
+            else (handler, args, kwargs) for handler in handlers]
+
+  def dispatch(self, event, calls):
+    """ Make calls the way self.mode says. """
+    if self.mode == SYNC:
+      for handler, args, kwargs in calls:
+        self.call(handler, event, args, kwargs)
+      return
+    if self.mode == ASYNC:
+      coro = self.gather(event, calls)
       try:
-        handler(event, *args, **kwargs)
-      # except SupressEvent:
-        # break
-      except Exception as err:
-        msg="error on event {ev}: {err} ({typ}) (in {hdl})" \
-                .format(err=err, typ=type(err), ev=event, hdl=handler)
-        self.log.error(msg)
+        return asyncio.get_running_loop().create_task(coro)
+      except RuntimeError:  # not in the loop's thread
+        if self.loop:
+          return asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return asyncio.run(coro)
+    return [self.submit(handler, event, args, kwargs)
+            for handler, args, kwargs in calls]
+
+  def call(self, handler, event, args, kwargs):
+    timeout = self.timeouts.get(handler, self.timeout)
+    start = time.monotonic() if timeout else 0
+    try:
+      handler(event, *args, **kwargs)
+    # except SupressEvent:
+      # break
+    except Exception as err:
+      self.error(event, handler, err)
+    # cannot interrupt a handler, can tell it was slow
+    if timeout and time.monotonic() - start > timeout:
+      self.timed_out(event, handler, timeout)
+
+  def submit(self, handler, event, args, kwargs):
+    future = self.executor.submit(handler, event, *args, **kwargs)
+    def done(future):
+      if not future.cancelled() and future.exception():
+        self.error(event, handler, future.exception())
+    future.add_done_callback(done)
+    timeout = self.timeouts.get(handler, self.timeout)
+    if timeout:
+      watchdog.watch(future, timeout,
+                     lambda f: self.timed_out(event, handler, timeout))
+    return future
+
+  async def afire(self, event, *args, **kwargs):
+    """ Run handlers of event concurrently, return their results
+        (None for the failed ones).
+    """
+    calls = self.calls(self.route(event), args, kwargs)
+    return await self.gather(event, calls)
+
+  async def gather(self, event, calls):
+    return await asyncio.gather(
+      *[self.acall(handler, event, args, kwargs)
+        for handler, args, kwargs in calls])
+
+  async def acall(self, handler, event, args, kwargs):
+    timeout = self.timeouts.get(handler, self.timeout)
+    try:
+      if inspect.iscoroutinefunction(handler):
+        return await asyncio.wait_for(handler(event, *args, **kwargs), timeout)
+      return handler(event, *args, **kwargs)
+    except asyncio.TimeoutError:
+      self.timed_out(event, handler, timeout)
+    except Exception as err:
+      self.error(event, handler, err)
+
+
+class Coalescer:
+  """ Collects payloads and fires them in batches with fire_many():
+      as soon as `size` payloads of an event are collected or `delay`
+      seconds after the first one.
+  """
+  def __init__(self, hook, size=1000, delay=0.1):
+    self.hook = hook
+    self.size = size
+    self.delay = delay
+    self.buffers = {}         # event -> list of payloads
+    self.deadlines = deque()  # (time, event, buffer), oldest first
+    self.cond = threading.Condition()
+    self.thread = threading.Thread(target=self.run, name="hook coalescer",
+                                   daemon=True)
+    self.thread.start()
+    atexit.register(self.flush)
+
+  def fire(self, event, payload):
+    with self.cond:
+      buffer = self.buffers.get(event)
+      if buffer is None:
+        if not self.hook.route(event):
+          return  # nobody listens
+        buffer = self.buffers[event] = []
+        self.deadlines.append((time.monotonic() + self.delay, event, buffer))
+        if len(self.deadlines) == 1:
+          self.cond.notify()
+      buffer.append(payload)
+      if len(buffer) < self.size:
+        return
+      del self.buffers[event]
+    self.hook.fire_many(event, buffer)
+
+  def run(self):
+    while True:
+      with self.cond:
+        while not self.deadlines or \
+              self.deadlines[0][0] > time.monotonic():
+          timeout = self.deadlines[0][0] - time.monotonic() \
+                    if self.deadlines else None
+          self.cond.wait(timeout)
+        _, event, buffer = self.deadlines.popleft()
+        if self.buffers.get(event) is not buffer:
+          continue  # was fired because it got full
+        del self.buffers[event]
+      self.hook.fire_many(event, buffer)
 
+  def flush(self):
+    """ Fire everything that is buffered now. """
+    with self.cond:
+      buffers, self.buffers = self.buffers, {}
+    for event, buffer in buffers.items():
+      self.hook.fire_many(event, buffer)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Event dispatch benchmarks for hook. """
+import time
+
+from useful.hook import Hook, Coalescer
+
+
+def handler(event, *args):
+  pass
+
+
+def subscribed(subs=10000, services=100):
+  """ Hook with subs subscriptions, a tenth of them are patterns. """
+  hook = Hook()
+  patterns = subs // 10
+  for i in range(subs - patterns):
+    hook.register("svc%d.evt%d" % (i % services, i // services), handler)
+  for i in range(patterns):
+    svc = i % services
+    hook.register(["svc%d.*" % svc, "svc%d.**" % svc, "*.evt%d" % i][i % 3],
+                  handler)
+  return hook
+
+
+def routing(fires=1000000, names=1000):
+  """ Fires per second with the routing table and with a scan
+      of all patterns (what every fire would cost without it).
+  """
+  hook = subscribed()
+  events = ["svc%d.evt%d" % (i % 100, i % 97) for i in range(names)]
+  start = time.perf_counter()
+  for i in range(fires):
+    hook.fire(events[i % names], i)
+  cached = fires / (time.perf_counter() - start)
+
+  scans = 1000
+  start = time.perf_counter()
+  for i in range(scans):
+    hook.routes = {}
+    hook.fire(events[i % names], i)
+  scanned = scans / (time.perf_counter() - start)
+  return dict(subscriptions=sum(map(len, hook.cb_map.values())),
+              patterns=len(hook.patterns), names=names,
+              cached=cached, scanned=scanned)
+
+
+def batching(samples=1000000, size=1000):
+  """ Samples per second: one fire() per sample, fire_many() to a batch
+      handler, Coalescer, and fire() of an event nobody listens to.
+  """
+  hook = Hook()
+  hook.register("metric", handler)
+  hook.register("batch", handler, batch=True)
+  data = list(range(size))
+  results = {}
+
+  start = time.perf_counter()
+  for i in range(samples):
+    hook.fire("metric", i)
+  results["fire"] = samples / (time.perf_counter() - start)
+
+  start = time.perf_counter()
+  for i in range(samples // size):
+    hook.fire_many("batch", data)
+  results["fire_many"] = samples / (time.perf_counter() - start)
+
+  coalescer = Coalescer(hook, size=size)
+  start = time.perf_counter()
+  for i in range(samples):
+    coalescer.fire("batch", i)
+  coalescer.flush()
+  results["coalescer"] = samples / (time.perf_counter() - start)
+
+  start = time.perf_counter()
+  for i in range(samples):
+    hook.fire("nobody", i)
+  results["unhandled"] = samples / (time.perf_counter() - start)
+  return results
+
+
+if __name__ == '__main__':
+  r = routing()
+  print("{subscriptions} subscriptions ({patterns} patterns), {names} event"
+        " names".format(**r))
+  print("routing table: {cached:>10.0f} fires/s".format(**r))
+  print("pattern scan:  {scanned:>10.0f} fires/s".format(**r))
+  print()
+  for name, rate in batching().items():
+    print("{:<14} {:>10.0f} samples/s".format(name + ":", rate))
@@ -1,18 +1,29 @@
 #!/usr/bin/env python3
 
-from functools import total_ordering
-from collections import deque
+from collections import namedtuple
+from itertools import accumulate
+from bisect import bisect_right
 from select import select
+from array import array
+import threading
+import asyncio
+import codecs
 import termios
 import signal
 import math
+import time
 import tty
 import sys
+import re
 import os
 
 from useful.timer import Timer
 from useful.myenum import Enum
 from blessings import Terminal
+try:
+  import numpy as np
+except ImportError:
+  np = None  # Chart buckets samples in pure Python then
 
 t = Terminal()
 
@@ -41,6 +52,18 @@ def splitline(line, size):
   return result
 
 
+def diffspan(old, new):
+  """ Return [start, stop) span of positions where old and new differ. """
+  size = max(len(old), len(new))
+  start = 0
+  while start < size and old[start:start+1] == new[start:start+1]:
+    start += 1
+  stop = size
+  while stop > start and old[stop-1:stop] == new[stop-1:stop]:
+    stop -= 1
+  return start, stop
+
+
 class Error(Exception):
   """ Generic class for all errors of this module. """
 
@@ -49,44 +72,104 @@ class NoSpace(Error):
   """ Not enough space to display widget. """
 
 
-@total_ordering
-class XY:
-  def __init__(self, x=0, y=0):
-    self.x = x
-    self.y = y
+class XY(namedtuple('XY', 'x y', defaults=(0, 0))):
+  """ Immutable point or size, a tuple of (x, y). """
+  __slots__ = ()
+  __hash__ = tuple.__hash__
 
   def __add__(self, other):
-    return self.__class__(self.x + other.x,
-                          self.y + other.y)
+    return _new(self.__class__, (self[0] + other[0], self[1] + other[1]))
 
   def __sub__(self, other):
-    return self.__class__(self.x - other.x,
-                          self.y - other.y)
+    return _new(self.__class__, (self[0] - other[0], self[1] - other[1]))
 
   def __gt__(self, other):
-    return self.x > other.x and self.y > other.y
+    return self[0] > other[0] and self[1] > other[1]
 
   def __ge__(self, other):
-    return self.x >= other.x and self.y >= other.y
+    return self[0] >= other[0] and self[1] >= other[1]
+
+  # the two below are what total_ordering used to derive from __gt__
+  def __lt__(self, other):
+    return not self > other and self != other
+
+  def __le__(self, other):
+    return not self > other
 
   def __eq__(self, other):
     if not isinstance(other, self.__class__):
       return False
-    return self.x == other.x and self.y == other.y
+    return tuple.__eq__(self, other)
 
-  def __iter__(self):
-    return iter([self.x, self.y])
+  def __ne__(self, other):
+    return not self == other
 
   def __repr__(self):
     cls = self.__class__.__name__
-    return "%s(%s, %s)" % (cls, self.x, self.y)
+    return "%s(%s, %s)" % (cls, self[0], self[1])
+
+
+_new = tuple.__new__
+# shared instances of common values
+ORIGIN = XY(0, 0)
+ONE = XY(1, 1)
+TWO = XY(2, 2)
+
+
+class Rect(namedtuple('Rect', 'pos size')):
+  """ Screen rectangle: top-left corner and size. """
+  __slots__ = ()
+
+  def __or__(self, other):
+    """ Bounding rectangle of both. """
+    (x1, y1), (w1, h1) = self
+    (x2, y2), (w2, h2) = other
+    x, y = min(x1, x2), min(y1, y2)
+    return Rect(XY(x, y), XY(max(x1+w1, x2+w2)-x, max(y1+h1, y2+h2)-y))
+
+  def __and__(self, other):
+    """ Intersection, its size is zero if there is none. """
+    (x1, y1), (w1, h1) = self
+    (x2, y2), (w2, h2) = other
+    x, y = max(x1, x2), max(y1, y2)
+    w = max(0, min(x1+w1, x2+w2) - x)
+    h = max(0, min(y1+h1, y2+h2) - y)
+    return Rect(XY(x, y), XY(w, h))
+
+  def __contains__(self, pos):
+    (x, y), (w, h) = self
+    return x <= pos[0] < x+w and y <= pos[1] < y+h
+
+  def __bool__(self):
+    """ False for empty rectangle. """
+    return self[1][0] > 0 and self[1][1] > 0
+
+  def spans(self):
+    """ Rows of the rectangle as (x, y, width) tuples of ints. """
+    (x, y), (w, h) = self
+    for row in range(y, y+h):
+      yield x, row, w
+
+  def __repr__(self):
+    cls = self.__class__.__name__
+    return "%s(%s, %s)" % (cls, self.pos, self.size)
 
 
 class Canvas:
   size = None
-  pos  = XY(0, 0)
-
-  def __init__(self):
+  rect = None
+  pos  = ORIGIN
+
+  def __init__(self, stream=None, term=None):
+    """ term is the terminal to draw on, module-level blessings
+        Terminal by default. Pass vterm.VirtualTerminal() to run
+        headless, output goes to its screen then.
+    """
+    self.term = term if term else t
+    if stream:
+      self.stream = stream
+    else:
+      self.stream = term.stream if term else sys.stdout
     self.resize()
 
   def curs_set(self, lvl):
@@ -95,26 +178,237 @@ class Canvas:
     pass
 
   def set_pos(self, pos=None):
-    assert XY(0, 0) <= pos < self.size
+    assert pos in self.rect
     self.pos = pos
-    raw = t.move(self.pos.y, self.pos.x)
-    print(raw, end='')
+    self.stream.write(self.term.move(self.pos.y, self.pos.x))
 
   def resize(self):
-    self.size = XY(t.width, t.height)
+    self.size = XY(self.term.width, self.term.height)
+    self.rect = Rect(ORIGIN, self.size)
     return self.size
 
   def clear(self):
-    print(t.clear)
+    self.stream.write(self.term.clear)
+    self.stream.flush()
 
   def printf(self, text, pos, movecur=False):
+    """ Print text at pos, which is XY or any (x, y) pair. """
+    x, y = pos
     if movecur:
-        print(t.move(pos.y, pos.x), end='')
-        print(str(text), end='')
+      self.stream.write(self.term.move(y, x) + str(text))
+      self.stream.flush()
     else:
-      with t.location(pos.x, pos.y):
-        print(str(text), end='')
-    sys.stdout.flush()
+      self._write(self.term.move(y, x) + str(text))
+
+  def _write(self, data):
+    """ Send escape stream in one go, cursor stays where it was. """
+    term = self.term
+    self.stream.write(term.save + data + term.restore)
+    self.stream.flush()
+
+  def lines(self, pos, lines):
+    """ Print lines one under another starting at pos. """
+    x, y = pos
+    move = self.term.move
+    self._write(''.join(move(y+i, x) + str(line)
+                        for i, line in enumerate(lines)))
+
+  def segments(self, pos, segments):
+    """ Print line made of (text, style) segments. """
+    normal = self.term.normal
+    self.printf(''.join(style + text + normal if style else text
+                        for text, style in segments if text), pos)
+
+  def hline(self, pos, width, ch='─', style=''):
+    self.segments(pos, [(ch*width, style)])
+
+  def vline(self, pos, height, ch='│', style=''):
+    if style:
+      ch = style + ch + self.term.normal
+    self.lines(pos, [ch]*height)
+
+  def fill(self, rect, ch=' ', style=''):
+    """ Fill rectangle with ch. """
+    pos, (width, height) = rect
+    line = ch*width
+    if style:
+      line = style + line + self.term.normal
+    self.lines(pos, [line]*height)
+
+  def box(self, rect, label='', style=''):
+    """ Draw frame around rectangle, label goes to the top edge. """
+    (x, y), (width, height) = rect
+    hline = '─' * (width-2)
+    lines = ['┌' + label + hline[len(label):] + '┐']
+    lines += ['│' + self.term.move_x(x+width-1) + '│'] * (height-2)
+    lines += ['└' + hline + '┘']
+    if style:
+      lines = [style + line + self.term.normal for line in lines]
+    self.lines((x, y), lines)
+
+  def flush(self):
+    """ Push pending output to the terminal.
+        Direct canvas writes everything immediately,
+        so there is nothing to do here.
+    """
+    pass
+
+
+# matches CSI sequences ("\x1b[1;31m") and short ones like "\x1b(B"
+ESCAPE = re.compile(r'(\x1b(?:\[[0-?]*[ -/]*[@-~]|[()][0-~]|[0-~]))')
+RESET = ('\x1b[m', '\x1b[0m')
+
+
+class BufferedCanvas(Canvas):
+  """ Back-buffered canvas.
+
+      Widgets draw into an in-memory grid of (char, style) cells.
+      flush() compares it with what is already on the screen and
+      sends only changed cells as a single write().
+  """
+  blank = (' ', '')
+
+  def __init__(self, stream=None, size=None, term=None):
+    self.fixed = size   # size to use instead of terminal size
+    self.lock = threading.RLock()
+    self.cursor = None  # where to leave cursor after flush
+    self.prefix = ''    # emitted before the diff, e.g. screen clear
+    super().__init__(stream, term)
+
+  def set_pos(self, pos=None):
+    assert pos in self.rect
+    self.pos = pos
+    self.cursor = pos
+
+  def resize(self):
+    with self.lock:
+      term = self.term
+      self.size = self.fixed if self.fixed else XY(term.width, term.height)
+      self.rect = Rect(ORIGIN, self.size)
+      width, height = self.size
+      self.back = [[self.blank]*width for _ in range(height)]
+      # None never matches a cell, so the first flush repaints everything
+      self.front = [[None]*width for _ in range(height)]
+      return self.size
+
+  def clear(self):
+    with self.lock:
+      width = self.size.x
+      for back, front in zip(self.back, self.front):
+        back[:] = front[:] = [self.blank]*width
+      self.prefix = self.term.clear
+
+  def put(self, pos, cells):
+    """ Put list of (char, style) cells at pos, clipping them. """
+    x, y = pos
+    with self.lock:
+      if 0 <= y < self.size.y:
+        row = self.back[y]
+        start, stop = max(x, 0), min(x+len(cells), len(row))
+        if start < stop:
+          row[start:stop] = cells[start-x:stop-x]
+
+  def printf(self, text, pos, movecur=False):
+    text = str(text)
+    x, y = pos
+    with self.lock:
+      if 0 <= y < self.size.y:
+        row = self.back[y]
+        width = len(row)
+        if '\x1b' not in text:
+          # fast path: plain text, clip it and copy in one go
+          start, stop = max(x, 0), min(x+len(text), width)
+          if start < stop:
+            row[start:stop] = [(ch, '') for ch in text[start-x:stop-x]]
+          x += len(text)
+        else:
+          style = ''
+          for i, chunk in enumerate(ESCAPE.split(text)):
+            if i % 2:  # odd chunks are escape sequences
+              style = '' if chunk in RESET else style + chunk
+              continue
+            for ch in chunk:
+              if 0 <= x < width:
+                row[x] = (ch, style)
+              x += 1
+      if movecur:
+        self.cursor = XY(x, y)
+
+  def lines(self, pos, lines):
+    x, y = pos
+    with self.lock:
+      for i, line in enumerate(lines):
+        self.printf(line, (x, y+i))
+
+  def segments(self, pos, segments):
+    cells = []
+    for text, style in segments:
+      cells += [(ch, style) for ch in text]
+    self.put(pos, cells)
+
+  def hline(self, pos, width, ch='─', style=''):
+    self.put(pos, [(ch, style)] * width)
+
+  def vline(self, pos, height, ch='│', style=''):
+    x, y = pos
+    cell = [(ch, style)]
+    with self.lock:
+      for row in range(y, y+height):
+        self.put((x, row), cell)
+
+  def fill(self, rect, ch=' ', style=''):
+    (x, y), (width, height) = rect
+    cells = [(ch, style)] * width
+    with self.lock:
+      for row in range(y, y+height):
+        self.put((x, row), cells)
+
+  def box(self, rect, label='', style=''):
+    (x, y), (width, height) = rect
+    with self.lock:
+      self.segments((x, y), [('┌', style), (label, style),
+                             ('─' * (width-2-len(label)), style), ('┐', style)])
+      self.vline((x, y+1), height-2, '│', style)
+      self.vline((x+width-1, y+1), height-2, '│', style)
+      self.segments((x, y+height-1), [('└' + '─'*(width-2) + '┘', style)])
+
+  def flush(self):
+    with self.lock:
+      out = [self.prefix]
+      self.prefix = ''
+      move = self.term.move
+      normal = self.term.normal
+      style = ''
+      cur = None  # terminal cursor position while we are writing
+      for y, (back, front) in enumerate(zip(self.back, self.front)):
+        if back == front:
+          continue
+        for x, cell in enumerate(back):
+          if cell == front[x]:
+            continue
+          if cur != (x, y):
+            gap = back[cur[0]:x] if cur and cur[1] == y else None
+            if gap and len(gap) <= 4 and all(c[1] == style for c in gap):
+              # cheaper to repeat a few cells than to move the cursor
+              out.append(''.join(c[0] for c in gap))
+            else:
+              out.append(move(y, x))
+          ch, cellstyle = cell
+          if cellstyle != style:
+            out.append(normal + cellstyle)
+            style = cellstyle
+          out.append(ch)
+          cur = (x+1, y)
+        front[:] = back
+      if style:
+        out.append(normal)
+      data = ''.join(out)
+      if not data:
+        return
+      if self.cursor:
+        data += move(self.cursor.y, self.cursor.x)
+      self.stream.write(data)
+      self.stream.flush()
 
 
 fixed = 0
@@ -124,9 +418,9 @@ both = 3
 
 
 class Widget:
-  pos = XY(0, 0)      # position
-  size = XY(0, 0)     # actual widget size calculated in set_size
-  minsize = XY(1, 1)  # minimum size for stretching widgets
+  pos = ORIGIN        # position
+  size = ORIGIN       # actual widget size calculated in set_size
+  minsize = ONE       # minimum size for stretching widgets
   stretch = fixed     # widget size policy
   id = None           # ID that can be selected
   all_ids = []        # used for checking ID uniqueness
@@ -136,6 +430,11 @@ class Widget:
   can_focus = False   # widget can receive a focus
   canvas = None       # where all widgets draw themselves
   has_focus = False
+  damaged = {}        # widget -> Rect waiting to be repainted, None: all
+  damage_lock = threading.Lock()
+  scheduler = None    # Scheduler of the running loop()
+  laid_out = None     # maxsize of the cached layout, None if invalid
+  placed = None       # pos of the cached layout, None if invalid
 
   def __init__(self, *children, **kwargs):
     self.children = list(children)
@@ -158,12 +457,20 @@ class Widget:
     if clear:
       canvas.clear()
     self.set_canvas(canvas)
-    self.set_size(canvas.size)
-    self.set_pos(XY(0, 0))
     self.setup_sigwinch()
+    self.redraw_all()
+
+  def redraw_all(self):
+    """ Layout and draw the whole tree, this is the root widget. """
+    canvas = self.canvas
+    self.layout(canvas.size)
+    self.place(ORIGIN)
+    with self.damage_lock:
+      self.damaged.clear()  # full redraw covers everything
     self.draw()
     if self.cur_focus:
       self.cur_focus.on_focus()
+    canvas.flush()
 
   def move_focus(self, inc=1):
     """ Switch focus to next widget. """
@@ -192,9 +499,45 @@ class Widget:
       raise Exception("unknown stretch policy %s" % self.stretch)
     return self.size
 
-  def set_pos(self, pos=XY(0, 0)):
+  def set_pos(self, pos=ORIGIN):
     self.pos = pos
 
+  @property
+  def rect(self):
+    return Rect(self.pos, self.size)
+
+  def layout(self, maxsize):
+    """ Cached set_size(): a subtree is not recomputed
+        if maxsize is the same and nothing inside changed.
+    """
+    if self.laid_out == maxsize:
+      return self.size
+    size = self.set_size(maxsize)
+    self.laid_out = maxsize
+    self.placed = None  # children may move even if pos is the same
+    return size
+
+  def place(self, pos):
+    """ Cached set_pos(). """
+    if self.placed == pos:
+      return
+    self.set_pos(pos)
+    self.placed = pos
+
+  def relayout(self):
+    """ Call when size constraints of this widget changed.
+        Only the ancestors are laid out again, siblings
+        reuse their cached layout.
+    """
+    widget = self
+    while widget:
+      widget.laid_out = widget.placed = None
+      root, widget = widget, widget.parent
+    if root.canvas:
+      root.layout(root.canvas.size)
+      root.place(ORIGIN)
+      root.invalidate()
+
   def set_canvas(self, canvas):
     self.canvas = canvas
     for child in self.children:
@@ -211,10 +554,67 @@ class Widget:
     """ Draw widget on canvas. """
     raise NotImplementedError
 
+  def redraw(self, *args, **kwargs):
+    """ Draw widget and push the result to the terminal. """
+    self.draw(*args, **kwargs)
+    self.canvas.flush()
+
+  async def flushed(self):
+    """ Wait till damage of this widget is on the screen.
+        Returns at once unless there is an asyncio scheduler.
+    """
+    if isinstance(self.scheduler, AsyncScheduler):
+      while self in self.damaged and self.scheduler.pending:
+        await self.scheduler.wait_frame()
+
+  def invalidate(self, rect=None):
+    """ Mark rect (the whole widget by default) as damaged. """
+    damaged = self.damaged
+    with self.damage_lock:
+      if self in damaged:
+        old = damaged[self]
+        # None is the whole widget, it covers anything
+        if old and rect:
+          damaged[self] = old | rect
+        else:
+          damaged[self] = None
+      else:
+        damaged[self] = rect
+    self.schedule()
+
+  def schedule(self):
+    """ Called when damage is added. Repaints right away
+        unless there is a scheduler to do this on its next frame.
+    """
+    if self.scheduler:
+      self.scheduler.wakeup()
+    else:
+      self.render()
+
+  def repaint(self, rect):
+    """ Redraw damaged rect. Widgets that can redraw
+        only a part of themselves override this.
+    """
+    self.draw()
+
+  def render(self):
+    """ Repaint all damaged widgets and flush the canvas. """
+    if not self.canvas:
+      return  # not on screen yet, initroot will draw everything
+    with self.damage_lock:
+      damaged = dict(self.damaged)
+      self.damaged.clear()
+    for widget, rect in damaged.items():
+      parent = widget.parent
+      while parent and parent not in damaged:
+        parent = parent.parent
+      if parent:
+        continue  # repainted together with the parent
+      widget.repaint(rect or widget.rect)
+    self.canvas.flush()
+
   def clear(self, filler=' '):
-    for y in range(self.size.y):
-      pos = XY(self.pos.x, self.pos.y+y)
-      self.canvas.printf(filler*self.size.x, pos)
+    self.canvas.fill(self.rect, filler)
 
   def input(self, key):
     if key == ARROW.UP:
@@ -223,12 +623,18 @@ class Widget:
       self.move_focus(1)
 
   def on_sigwinch(self, sig, frame):
+    # a burst of signals while dragging a window results
+    # in a single relayout on the next scheduler frame
+    if self.scheduler:
+      self.scheduler.resize()
+    else:
+      self.on_resize()
+
+  def on_resize(self):
+    """ Terminal was resized, this is the root widget. """
     self.canvas.resize()
     self.canvas.clear()
-    self.initroot(self.canvas)
-    self.draw()
-    if self.cur_focus:
-      self.cur_focus.on_focus()
+    self.redraw_all()
 
   def setup_sigwinch(self):
     # there is no old hanlder, see 'python Issue3949'
@@ -260,7 +666,7 @@ class VList(Widget):
     size_y = 0
     for child in self.children:
       child_pos = XY(pos.x, pos.y+size_y)
-      child.set_pos(child_pos)
+      child.place(child_pos)
       size_y += child.size.y
 
   def set_size(self, maxsize):
@@ -275,14 +681,14 @@ class VList(Widget):
     size = XY(size_x, size_y)
     for child in rigid:
       child_maxsize = XY(maxsize.x, maxsize.y-size.y)
-      child.set_size(child_maxsize)
+      child.layout(child_maxsize)
       size_x = max(size_x, child.size.x)
       size_y += child.size.y
       size = XY(size_x, size_y)
     flex_ybudget = maxsize.y - size.y
     for child in flexible:
       child_maxsize = XY(maxsize.x, flex_ybudget//len(flexible))
-      child.set_size(child_maxsize)
+      child.layout(child_maxsize)
       size_x = max(size_x, child.size.x)
       size_y += child.size.y
       size = XY(size_x, size_y)
@@ -301,7 +707,7 @@ class HList(VList):
     maxx = maxsize.x // len(self.children)
     for child in self.children:
       child_maxsize=XY(maxx, maxsize.y)
-      child.set_size(child_maxsize)
+      child.layout(child_maxsize)
     self.size = XY(maxsize.x, max(child.size.y for child in self.children))
     return self.size
 
@@ -309,7 +715,7 @@ class HList(VList):
     self.pos = pos
     for i, child in enumerate(self.children):
       child_pos = XY(pos.x + self.size.x // len(self.children) * i, pos.y)
-      child.set_pos(child_pos)
+      child.place(child_pos)
 
 
 class String(Widget):
@@ -318,11 +724,17 @@ class String(Widget):
     self.text = text
 
   def update(self, newtext):
-    # TODO: suboptimal code, we can clear only the rest of the string
-    if len(newtext) < len(self.text):
-      self.clear()
-    self.text = newtext[:self.size.x]  # TODO: resize or clip with elipsis?
-    self.draw()
+    newtext = newtext[:self.size.x]  # TODO: resize or clip with elipsis?
+    start, stop = diffspan(self.text, newtext)
+    self.text = newtext
+    if start < stop:
+      self.invalidate(Rect(self.pos+XY(start, 0), XY(stop-start, 1)))
+
+  def repaint(self, rect):
+    start = rect.pos.x - self.pos.x
+    stop = start + rect.size.x
+    # padding erases the tail of a longer old text
+    self.canvas.printf(self.text.ljust(stop)[start:stop], rect.pos)
 
   def draw(self):
     self.canvas.printf(self.text[:self.size.x], self.pos)
@@ -351,6 +763,9 @@ class Button(String):
     if self.cb:
       self.cb()
 
+  def repaint(self, rect):
+    self.draw()  # decorations shift the text, just draw it all
+
   def input(self, key):
     if key == '\n':
       self.on_click()
@@ -367,53 +782,218 @@ class Button(String):
     self.canvas.printf(text, self.pos)
 
 
+class Scrollback:
+  """ Line buffer that remembers where each line ends in wrapped rows.
+
+      ends[i] counts rows from the first line ever added to the end of
+      line i, so the line at any row is found by bisection and only
+      the lines inside the visible window are wrapped, however far
+      back the window is.
+  """
+  def __init__(self, maxlen=1000):
+    self.maxlen = maxlen
+    self.buf = []     # lines, the first `start` ones are pushed out
+    self.ends = []    # row where each line ends, same indexes
+    self.start = 0
+    self.width = 0
+    self.lock = threading.Lock()
+
+  @property
+  def lines(self):
+    return self.buf[self.start:]
+
+  @property
+  def total(self):
+    """ Rows all lines take. """
+    if len(self.ends) == self.start:
+      return 0
+    return self.ends[-1] - self.begin(self.start)
+
+  def begin(self, i):
+    """ Row where line i starts. """
+    if i:
+      return self.ends[i-1]
+    return self.ends[0] - self.count(self.buf[0]) if self.ends else 0
+
+  def count(self, line):
+    """ Number of rows line takes. """
+    if not self.width:
+      return 1
+    return max(1, -(-len(line) // self.width))
+
+  def compact(self):
+    del self.buf[:self.start]
+    del self.ends[:self.start]
+    self.start = 0
+
+  def set_width(self, width):
+    if width == self.width:
+      return
+    with self.lock:
+      self.width = width
+      self.compact()
+      self.ends = list(accumulate(map(self.count, self.buf)))
+
+  def append(self, line):
+    """ Add line, return number of rows it takes. """
+    rows = self.count(line)
+    with self.lock:
+      self.ends.append((self.ends[-1] if self.ends else 0) + rows)
+      self.buf.append(line)
+      if len(self.buf) - self.start > self.maxlen:
+        self.start += 1  # pushed out
+        if self.start >= self.maxlen:
+          self.compact()  # amortized, once per maxlen lines
+    return rows
+
+  def clear(self):
+    with self.lock:
+      self.buf, self.ends, self.start = [], [], 0
+
+  def window(self, height, offset=0):
+    """ Return up to height rows ending offset rows above the last one. """
+    result = []
+    with self.lock:
+      if len(self.ends) == self.start:
+        return result
+      bottom = self.ends[-1] - offset
+      top = bottom - height
+      i = bisect_right(self.ends, top, self.start)  # first line below top
+      for i in range(i, len(self.ends)):
+        begin = self.begin(i)
+        if begin >= bottom:
+          break
+        line = self.buf[i]
+        chunks = splitline(line, self.width) if self.width else [line]
+        result.extend((chunks or [''])[max(top, begin) - begin:
+                                       bottom - begin])
+    return result
+
+  def __len__(self):
+    return len(self.buf) - self.start
+
+
 class Text(Widget):
-  """ Text canvas. """
+  """ Text canvas with scrollback. """
   minsize = XY(5, 5)
   stretch = both
 
-  def __init__(self, **kwargs):
+  def __init__(self, history=1000, **kwargs):
     super().__init__(**kwargs)
-    self.lines = deque(maxlen=1000)
-    self.dirty = 0  # buffer needs to be flushed
-    self.timer = Timer(self.draw, None)
-    self.timer.start()
-
-  def draw(self, force=True):
-    if not force:
-      if not self.dirty:
-        self.timer.restart(0.3)
-      self.dirty += 1
-      if self.dirty < 5:
-        return
+    self.buffer = Scrollback(history)
+    self.offset = 0     # rows scrolled back from the end
+    self.filled = 0     # rows in use, None if unknown
+    self.dirty = 0      # buffer needs to be flushed
+    self.timer = None   # only needed without a scheduler
+
+  @property
+  def lines(self):
+    return self.buffer.lines
+
+  def set_size(self, maxsize):
+    width = self.size.x
+    size = super().set_size(maxsize)
+    if size.x != width:
+      self.filled = None  # lines are wrapped again, repaint counts them
+    self.buffer.set_width(size.x)
+    self.offset = min(self.offset, self.top())
+    return size
+
+  def schedule(self):
+    """ Debounce: repaint after 5 lines or 0.3s. """
+    if self.scheduler:
+      return super().schedule()
+    if not self.timer:
+      self.timer = Timer(self.render, None)
+      self.timer.start()
+    if not self.dirty:
+      self.timer.restart(0.3)
+    self.dirty += 1
+    if self.dirty >= 5:
+      self.render()
+
+  def render(self):
     self.dirty = 0
-    self.timer.cancel()
+    if self.timer:
+      self.timer.cancel()
+    super().render()
 
-    # wrap long lines
-    result = []
-    for line in self.lines:
-      chunks = splitline(line, self.size.x)
-      result.extend(chunks)
-    # display only visible lines
-    visible = result[-self.size.y:]
-    for i, line in enumerate(visible):
-      pos = self.pos + XY(0, i)
-      # self.canvas.printf(" "*self.size.x, pos)
-      self.canvas.printf(line, pos)
-      filler = " " * (self.size.x - len(line))
-      self.canvas.printf(filler, pos + XY(len(line), 0))
+  def visible(self):
+    """ Wrapped lines that fit on the screen. """
+    return self.buffer.window(self.size.y, self.offset)
+
+  def top(self):
+    """ Maximum offset. """
+    return max(0, self.buffer.total - self.size.y)
+
+  def scroll(self, rows):
+    """ Scroll back in history by rows, negative rows scroll forward. """
+    offset = min(max(0, self.offset + rows), self.top())
+    if offset != self.offset:
+      self.offset = offset
+      self.invalidate()
+
+  def page_up(self):
+    self.scroll(self.size.y - 1)
+
+  def page_down(self):
+    self.scroll(1 - self.size.y)
+
+  def home(self):
+    """ Show the oldest lines. """
+    self.scroll(self.buffer.total)
+
+  def end(self):
+    """ Follow new lines again. """
+    self.scroll(-self.offset)
+
+  def draw(self):
+    self.repaint(self.rect)
+
+  def repaint(self, rect):
+    visible = self.visible()
+    self.filled = len(visible) if len(visible) < self.size.y else None
+    (x, y), width = self.pos, self.size.x
+    first = rect.pos.y - y
+    lines = visible[first:first+rect.size.y]
+    self.canvas.lines((x, y+first), [line.ljust(width) for line in lines])
 
   def println(self, s):
-    self.lines.append(str(s))
-    self.draw(force=False)
+    rows = self.buffer.append(str(s))
+    if self.offset:
+      # keep the view still while user reads history
+      self.offset = min(self.offset + rows, self.top())
+    elif self.filled is not None and self.filled + rows <= self.size.y:
+      # no scrolling yet, only the new rows change
+      pos = self.pos + XY(0, self.filled)
+      self.filled += rows
+      self.invalidate(Rect(pos, XY(self.size.x, rows)))
+    else:
+      self.filled = None
+      self.invalidate()
 
   def write(self, s):
     """ This one is just to emulate file API. """
     self.println(s.strip())
 
+  def input(self, key):
+    """ Scroll history, works if created with can_focus=True. """
+    if key == SPECIAL.PGUP:
+      self.page_up()
+    elif key == SPECIAL.PGDN:
+      self.page_down()
+    elif key == SPECIAL.HOME:
+      self.home()
+    elif key == SPECIAL.END:
+      self.end()
+    else:
+      super().input(key)
+
   def clear(self):
-    self.lines.clear()
-    self.draw()
+    self.buffer.clear()
+    self.offset = 0
+    self.filled = 0
+    self.invalidate()
 
 
 class Input(Widget):
@@ -435,7 +1015,7 @@ class Input(Widget):
       if self.text:
         self.text = self.text[:-1]
         self.draw()
-    elif key.isprintable():
+    elif len(key) == 1 and key.isprintable():
       if len(self.text) < self.size.x:
         self.text += key
         self.draw()
@@ -472,39 +1052,25 @@ class Border(Widget):
   def set_size(self, maxsize):
     label = self.label
     child = self.children[0]
-    child.set_size(maxsize-XY(2, 2))
+    child.layout(maxsize-TWO)
     size_x = max(child.size.x, len(label))  # make sure label fits
     size_y = child.size.y
-    self.size = XY(size_x, size_y) + XY(2, 2)  # 2x2 is a border
+    self.size = XY(size_x+2, size_y+2)  # 2x2 is a border
     return self.size
 
   def set_pos(self, pos):
     super().set_pos(pos)
     child = self.children[0]
-    child.set_pos(pos+XY(1, 1))  # 1x1 is offset by border
+    child.place(pos+ONE)  # 1x1 is offset by border
 
   def draw(self):
-    pos = self.pos
-    canvas = self.canvas
-    for y in [pos.y, pos.y+self.size.y-1]:
-      for x in range(pos.x+1, pos.x+self.size.x-1):
-        canvas.printf('─', pos=XY(x, y))
-
-    for x in [pos.x, pos.x+self.size.x-1]:
-      for y in range(pos.y+1, pos.y+self.size.y-1):
-        canvas.printf('│', pos=XY(x, y))
-
-    canvas.printf('┌', pos)
-    canvas.printf('┐', pos+XY(self.size.x-1, 0))
-    canvas.printf('└', pos+XY(0, self.size.y-1))
-    canvas.printf('┘', pos+self.size-XY(1, 1))
-
-    canvas.printf(self.label, pos+XY(1, 0))
+    self.canvas.box(self.rect, self.label)
     self.children[0].draw()
 
 
 class Bar(Widget):
   stretch = horiz
+  shown = None  # line() that is on the screen now
 
   def __init__(self, value=0, fmt="{:.3f}", color=t.green,
                r=Range(0, 1), overflow=t.red+t.bold, **kwargs):
@@ -522,13 +1088,13 @@ class Bar(Widget):
 
   def update(self, value):
     self.value = value
-    self.draw()
+    if self.line() != self.shown:
+      self.invalidate()
 
-  def draw(self):
+  def line(self):
+    """ Return bar text, filled length and color. """
     width = self.size.x
     value = self.value
-    pos_x = self.pos.x
-    pos_y = self.pos.y
     r = self.range
     # length = math.ceil(width*min(1, datum/maxval))
     percent = (self.value - r.min) / (r.max - r.min)
@@ -536,15 +1102,41 @@ class Bar(Widget):
     percent = max(percent, 0)
     length = math.ceil(width*percent)
     s = self.fmt.format(value)
-    label_len = len(s)
     # s += "█" * (length - len(s))
     s += " " * (self.size.x - len(s))
     color = self.color if value in self.range else self.overflow
-    self.canvas.printf(color + t.reverse + s[:length] +
-                       t.normal + s[length:], XY(pos_x, pos_y))
+    return s, length, color
+
+  @staticmethod
+  def cells(line):
+    """ Line as (char, color) cells, color is None for the unfilled part. """
+    s, length, color = line
+    return [(ch, color if i < length else None) for i, ch in enumerate(s)]
+
+  def repaint(self, rect):
+    # many updates may land between frames, so diff
+    # against what is on the screen rather than in update()
+    line = self.line()
+    start, stop = 0, self.size.x
+    if self.shown:
+      start, stop = diffspan(self.cells(self.shown), self.cells(line))
+    self.shown = line
+    s, length, color = line
+    split = max(start, min(length, stop))
+    self.canvas.segments((self.pos.x+start, self.pos.y),
+                         [(s[start:split], color + t.reverse),
+                          (s[split:stop], '')])
+
+  def draw(self):
+    self.shown = self.line()
+    s, length, color = self.shown
+    self.canvas.segments(self.pos, [(s[:length], color + t.reverse),
+                                    (s[length:], '')])
 
 
 class Bars(Widget):
+  shown = []  # rows on the screen now
+
   def __init__(self, data=[0], maxval=None, showvals=True, **kwargs):
     assert isinstance(data, list)
     super().__init__(**kwargs)
@@ -564,27 +1156,247 @@ class Bars(Widget):
   def update(self, data):
     assert isinstance(data, list)
     self.data = data
-    self.draw()
+    self.invalidate()
 
-  def draw(self):
+  def rows(self):
+    """ Rendered rows, empty if there is nothing to show. """
     width = self.size.x
     if self.maxval:
       maxval = self.maxval
     else:
       maxval = max(self.data)
     if not maxval:
-      return
-    for i, datum in enumerate(self.data):
-      pos_x = self.pos.x
-      pos_y = self.pos.y + i
+      return []
+    result = []
+    for datum in self.data:
       length = math.ceil(width*min(1, datum/maxval))
       s = "{:.2f}".format(datum)
       s += "█" * (length - len(s))
       s += " " * (self.size.x - len(s))
-      self.canvas.printf(t.red+t.inverse+s[:length]+t.normal+s[length:], XY(pos_x, pos_y))
+      result.append(t.red+t.inverse+s[:length]+t.normal+s[length:])
+    return result
+
+  def repaint(self, rect):
+    rows = self.rows()
+    shown = self.shown
+    for i, row in enumerate(rows):
+      if i >= len(shown) or row != shown[i]:
+        self.canvas.printf(row, (self.pos.x, self.pos.y+i))
+    if rows:
+      self.shown = rows
 
+  def draw(self):
+    rows = self.rows()
+    self.canvas.lines(self.pos, rows)
+    if rows:
+      self.shown = rows
+
+
+class Ring:
+  """ Fixed-size series of floats, oldest samples are overwritten.
+
+      Every sample is stored twice, at i and i+size, so the last n
+      samples are always one contiguous slice: appends never move
+      the history and reading it needs no copy.
+  """
+  def __init__(self, size):
+    self.size = size
+    if np:
+      self.buf = np.zeros(2*size)
+    else:
+      self.buf = array('d', bytes(16*size))
+    self.head = 0   # where the next sample goes
+    self.count = 0
+    self.lock = threading.Lock()
+
+  def append(self, value):
+    with self.lock:
+      i = self.head
+      self.buf[i] = self.buf[i+self.size] = value
+      self.head = (i + 1) % self.size
+      self.count = min(self.count + 1, self.size)
+
+  def extend(self, values):
+    """ Append many samples: a list, an array or anything
+        with buffer protocol.
+    """
+    size = self.size
+    if np:
+      values = np.asarray(values, dtype=float)[-size:]
+    else:
+      values = array('d', values)[-size:]
+    num = len(values)
+    with self.lock:
+      buf, i = self.buf, self.head
+      first = min(num, size - i)  # up to the end of the buffer
+      rest = num - first          # wraps around
+      buf[i:i+first] = buf[i+size:i+size+first] = values[:first]
+      buf[:rest] = buf[size:size+rest] = values[first:]
+      self.head = (i + num) % size
+      self.count = min(self.count + num, size)
+
+  def clear(self):
+    with self.lock:
+      self.head = self.count = 0
+
+  def view(self, num=None):
+    """ Last num samples, oldest first. A view into the buffer,
+        hold the lock while using it.
+    """
+    num = self.count if num is None else min(num, self.count)
+    end = self.head + self.size
+    if np:
+      return self.buf[end-num:end]
+    return memoryview(self.buf)[end-num:end]
+
+  def __len__(self):
+    return self.count
+
+
+def buckets(data, num):
+  """ Split data into num buckets of (almost) equal length, return
+      lists of their minimums, maximums and means. There are
+      fewer buckets if data is shorter than num.
+  """
+  count = len(data)
+  num = min(num, count)
+  if not num:
+    return [], [], []
+  if np:
+    data = np.asarray(data, dtype=float)
+    starts = np.arange(num) * count // num
+    lens = np.diff(starts, append=count)
+    return (np.minimum.reduceat(data, starts).tolist(),
+            np.maximum.reduceat(data, starts).tolist(),
+            (np.add.reduceat(data, starts) / lens).tolist())
+  mins, maxs, means = [], [], []
+  starts = [i * count // num for i in range(num+1)]
+  for start, stop in zip(starts, starts[1:]):
+    chunk = data[start:stop]
+    mins.append(min(chunk))
+    maxs.append(max(chunk))
+    means.append(sum(chunk) / (stop - start))
+  return mins, maxs, means
+
+
+BLOCKS = " ▁▂▃▄▅▆▇█"
+# braille dots of the left and right column, bottom to top
+DOTS = [(0x40, 0x04, 0x02, 0x01), (0x80, 0x20, 0x10, 0x08)]
+# 4 dots of a column as a nibble (bit 0 is the bottom) -> braille bits
+BRAILLE = [[sum(bit for k, bit in enumerate(dots) if nibble >> k & 1)
+            for nibble in range(16)] for dots in DOTS]
+
+
+class Chart(Widget):
+  """ Chart of a long series squeezed into the widget width.
+
+      Samples go into a ring buffer, every column shows a bucket of
+      them. "block" style draws a column up to the bucket's stat
+      (max, mean or min) with 1/8 cell steps, "braille" draws the
+      min..max envelope with 2x4 dots per cell.
+  """
+  stretch = horiz
+  shown = []  # rows on the screen now
+
+  def __init__(self, data=(), history=10000, height=4, style="block",
+               stat="max", r=None, fmt="{:.2f}", color=t.green, **kwargs):
+    assert style in ("block", "braille"), "unknown chart style %s" % style
+    assert stat in ("min", "max", "mean"), "unknown stat %s" % stat
+    super().__init__(**kwargs)
+    self.ring = Ring(history)
+    self.ring.extend(data)
+    self.height = height
+    self.style = style
+    self.stat = stat
+    self.range = r    # autoscale if None
+    self.fmt = fmt    # format of the last value, None to hide it
+    self.color = color
 
-SPECIAL = Enum("ESC BSPACE ENTER CTRLC".split())
+  def set_size(self, maxsize):
+    assert maxsize.y >= 1, "not enough screen space"
+    self.size = XY(maxsize.x, min(self.height, maxsize.y))
+    return self.size
+
+  def append(self, value):
+    self.ring.append(value)
+    self.invalidate()
+
+  def extend(self, values):
+    self.ring.extend(values)
+    self.invalidate()
+
+  def update(self, data):
+    """ Replace the whole series. """
+    self.ring.clear()
+    self.extend(data)
+
+  def scale(self, mins, maxs):
+    if self.range:
+      return self.range.min, self.range.max
+    lo, hi = min(0, min(mins)), max(maxs)
+    return lo, hi if hi > lo else lo + 1
+
+  def rows(self):
+    width, height = self.size
+    ring = self.ring
+    subcols = 2 if self.style == "braille" else 1
+    with ring.lock:
+      last = ring.buf[ring.head-1] if ring.count else None
+      mins, maxs, means = buckets(ring.view(), width*subcols)
+    if not mins:
+      return [" " * width] * height
+    lo, hi = self.scale(mins, maxs)
+    if self.style == "braille":
+      rows = self.braille(mins, maxs, lo, hi)
+    else:
+      values = {"min": mins, "max": maxs, "mean": means}[self.stat]
+      rows = self.blocks(values, lo, hi)
+    rows = [" " * (width - len(row)) + row for row in rows]  # right-align
+    if self.fmt:
+      label = self.fmt.format(last)[:width]
+      rows[0] = label + rows[0][len(label):]
+    return [self.color + row + t.normal for row in rows]
+
+  def blocks(self, values, lo, hi):
+    height = self.size.y
+    steps = height * 8
+    levels = [min(max(round((v - lo) / (hi - lo) * steps), 0), steps)
+              for v in values]
+    return [''.join(BLOCKS[min(max(level - base, 0), 8)] for level in levels)
+            for base in range(steps - 8, -1, -8)]
+
+  def braille(self, mins, maxs, lo, hi):
+    height = self.size.y
+    top = height * 4 - 1
+    masks = []  # dots of every column as bits, bit 0 is the bottom
+    for vmin, vmax in zip(mins, maxs):
+      bottom = min(max(round((vmin - lo) / (hi - lo) * top), 0), top)
+      up = min(max(round((vmax - lo) / (hi - lo) * top), 0), top)
+      masks.append((1 << up + 1) - (1 << bottom))
+    if len(masks) % 2:
+      masks.insert(0, 0)
+    left, right = BRAILLE
+    rows = []
+    for shift in range(top - 3, -1, -4):
+      rows.append(''.join(
+        chr(0x2800 | left[l >> shift & 15] | right[r >> shift & 15])
+        for l, r in zip(masks[::2], masks[1::2])))
+    return rows
+
+  def repaint(self, rect):
+    rows = self.rows()
+    shown = self.shown
+    for i, row in enumerate(rows):
+      if i >= len(shown) or row != shown[i]:
+        self.canvas.printf(row, (self.pos.x, self.pos.y+i))
+    self.shown = rows
+
+  def draw(self):
+    self.shown = self.rows()
+    self.canvas.lines(self.pos, self.shown)
+
+
+SPECIAL = Enum("ESC BSPACE ENTER CTRLC PGUP PGDN HOME END".split())
 ARROW = Enum("UP DOWN LEFT RIGHT".split())
 # from string.printable
 ascii = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!'  \
@@ -592,45 +1404,194 @@ ascii = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!'  \
 ASCII = Enum(ascii.split())
 
 
+# final characters of "\x1b[..." and "\x1bO..." sequences
+CSI_KEYS = {'A': ARROW.UP, 'B': ARROW.DOWN, 'C': ARROW.RIGHT,
+            'D': ARROW.LEFT, 'H': SPECIAL.HOME, 'F': SPECIAL.END}
+# parameters of "\x1b[...~" sequences
+TILDE_KEYS = {'1': SPECIAL.HOME, '4': SPECIAL.END, '7': SPECIAL.HOME,
+              '8': SPECIAL.END, '5': SPECIAL.PGUP, '6': SPECIAL.PGDN}
+
+
+class KeyDecoder:
+  """ Turns bytes read from the terminal into keys.
+
+      Data may come in chunks of any size, escape sequences and
+      UTF-8 characters split between chunks are handled.
+  """
+  def __init__(self):
+    self.utf8 = codecs.getincrementaldecoder('utf-8')('replace')
+    self.state = None   # None, 'esc' or 'csi'
+    self.params = ''    # parameters of the current escape sequence
+
+  def feed(self, data):
+    """ Return keys completed by data. """
+    keys = []
+    for ch in self.utf8.decode(data):
+      if self.state == 'csi':
+        if '0' <= ch <= '?':
+          self.params += ch
+          continue
+        self.state = None
+        if ch == '~':
+          key = TILDE_KEYS.get(self.params)
+        else:
+          key = CSI_KEYS.get(ch)
+        if key:
+          keys.append(key)
+      elif self.state == 'esc':
+        if ch == '\x1b':
+          keys.append(SPECIAL.ESC)
+        elif ch in '[O':
+          self.state = 'csi'
+          self.params = ''
+        else:
+          self.state = None
+          if ch in CSI_KEYS:
+            keys.append(CSI_KEYS[ch])
+      elif ch == '\x1b':
+        self.state = 'esc'
+      elif ch == '\x7f':
+        keys.append(SPECIAL.BSPACE)
+      elif ch == '\x03':
+        os.kill(0, signal.SIGINT)
+        # keys.append(SPECIAL.CTRLC)
+      elif ch == '\r':
+        # keys.append(SPECIAL.ENTER)
+        keys.append('\n')
+      else:
+        keys.append(ch)
+    return keys
+
+
 def myinput(timeout=None):
   stdin = sys.stdin
-  special = False
+  decoder = KeyDecoder()
   while True:
     try:
       r, _, _ = select([stdin], [], [], timeout)
       if not r:
         yield None
         continue
-      ch = os.read(stdin.fileno(), 1)
+      data = os.read(stdin.fileno(), 4096)
     except InterruptedError:  # "[Errno 4] Interrupted system call"
       continue
-    ch = ch.decode()
-    if ch == '\x1b':
-      if special:
-        yield SPECIAL.ESC
-      else:
-        special = True
-    elif ch == '[':
-      if not special:
-        yield ch
+    yield from decoder.feed(data)
+
+
+async def keys(fd=None):
+  """ Asynchronously read keys from terminal (stdin by default). """
+  if fd is None:
+    fd = sys.stdin.fileno()
+  loop = asyncio.get_running_loop()
+  chunks = asyncio.Queue()
+  decoder = KeyDecoder()
+  loop.add_reader(fd, lambda: chunks.put_nowait(os.read(fd, 4096)))
+  try:
+    while True:
+      for key in decoder.feed(await chunks.get()):
+        yield key
+  finally:
+    loop.remove_reader(fd)
+
+
+class Scheduler:
+  """ Renders damaged widgets at most fps times per second.
+
+      Widgets may be updated from any thread: invalidate() only
+      records damage and wakes up the loop. Damage piled up between
+      frames is merged per widget and repainted once.
+  """
+  def __init__(self, root, fps=30):
+    self.root = root
+    self.interval = 1 / fps
+    self.last = 0          # time of the last frame
+    self.pending = False   # there is damage to render
+    self.resized = False   # terminal was resized
+    self.lock = threading.Lock()
+    self.fd, self.wakeup_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+
+  def wakeup(self):
+    """ Request a frame. Only the first request per frame notifies loop. """
+    with self.lock:
+      if self.pending:
+        return
+      self.pending = True
+    self.notify()
+
+  def notify(self):
+    os.write(self.wakeup_fd, b'w')
+
+  def resize(self):
+    """ Request relayout. Called from signal handler, so no locks here. """
+    self.resized = True
+    self.pending = True
+    self.notify()
+
+  def timeout(self):
+    """ Seconds till the next frame, None if there is nothing to draw. """
+    if not self.pending:
+      return None
+    return max(0, self.last + self.interval - time.monotonic())
+
+  def drain(self):
+    """ Consume wakeups, call when fd is readable. """
+    try:
+      os.read(self.fd, 4096)
+    except BlockingIOError:
+      pass
+
+  def frame(self):
+    """ Render pending damage. """
+    with self.lock:
+      self.pending = False
+    if self.resized:
+      self.resized = False
+      self.root.on_resize()
     else:
-      if special:
-        special = False
-        if   ch == 'A': yield ARROW.UP
-        elif ch == 'B': yield ARROW.DOWN
-        elif ch == 'C': yield ARROW.RIGHT
-        elif ch == 'D': yield ARROW.LEFT
-      else:
-        if   ch == '\x7f':
-          yield SPECIAL.BSPACE
-        elif ch == '\x03':
-          os.kill(0, signal.SIGINT)
-          # yield SPECIAL.CTRLC
-        elif ch == '\r':
-          # yield SPECIAL.ENTER
-          yield '\n'
-        else:
-          yield ch
+      self.root.render()
+    self.last = time.monotonic()
+
+  def close(self):
+    os.close(self.fd)
+    os.close(self.wakeup_fd)
+
+
+class AsyncScheduler(Scheduler):
+  """ Scheduler that runs frames on asyncio event loop. """
+  def __init__(self, root, fps=30, loop=None):
+    self.root = root
+    self.interval = 1 / fps
+    self.last = 0
+    self.pending = False
+    self.resized = False
+    self.lock = threading.Lock()
+    self.loop = loop if loop else asyncio.get_running_loop()
+    self.waiters = []  # futures waiting for the next frame
+
+  def notify(self):
+    # may be called from other threads
+    self.loop.call_soon_threadsafe(self.plan)
+
+  def plan(self):
+    self.loop.call_later(self.timeout() or 0, self.frame)
+
+  def frame(self):
+    super().frame()
+    waiters, self.waiters = self.waiters, []
+    for fut in waiters:
+      if not fut.done():
+        fut.set_result(None)
+
+  async def wait_frame(self):
+    """ Wait till pending damage is on the screen. """
+    if not self.pending:
+      return
+    fut = self.loop.create_future()
+    self.waiters.append(fut)
+    await fut
+
+  def close(self):
+    pass
 
 
 def mywrapper(f):
@@ -647,12 +1608,44 @@ def mywrapper(f):
   return wrapped
 
 
-def loop(root, clear=True):
-  root.initroot(clear=clear)
-
-  for key in myinput():
-    #if key == SPECIAL.CTRLC:
-    #  os.kill(0, signal.SIGINT)
-    #  continue
-    if root.cur_focus:
-      root.cur_focus.input(key)
+def loop(root, clear=True, canvas=None, fps=30):
+  """ Run UI. Pass BufferedCanvas() as canvas to batch terminal output.
+      Widget updates are rendered at most fps times per second.
+  """
+  scheduler = Widget.scheduler = Scheduler(root, fps)
+  root.initroot(canvas, clear=clear)
+
+  stdin = sys.stdin.fileno()
+  decoder = KeyDecoder()
+  try:
+    while True:
+      r, _, _ = select([stdin, scheduler.fd], [], [], scheduler.timeout())
+      if stdin in r:
+        for key in decoder.feed(os.read(stdin, 4096)):
+          if root.cur_focus:
+            root.cur_focus.input(key)
+        root.canvas.flush()
+      if scheduler.fd in r:
+        scheduler.drain()
+      if scheduler.timeout() == 0:
+        scheduler.frame()
+  finally:
+    Widget.scheduler = None
+    scheduler.close()
+
+
+
+async def aloop(root, clear=True, canvas=None, fps=30):
+  """ asyncio version of loop(). Other coroutines may
+      update widgets and "await widget.flushed()".
+  """
+  scheduler = Widget.scheduler = AsyncScheduler(root, fps)
+  root.initroot(canvas, clear=clear)
+  try:
+    async for key in keys():
+      if root.cur_focus:
+        root.cur_focus.input(key)
+      root.canvas.flush()
+  finally:
+    Widget.scheduler = None
+    scheduler.close()
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
-from fnmatch import fnmatch
-from copy import copy
-import time
+from fnmatch import translate
+from types import FunctionType
+import itertools
+import threading
 import sys
+import re
+
+from useful.notifylist import NotifyingList
+from useful.tscache import Timestamp
 
 try:
     from termcolor import colored
@@ -11,6 +16,8 @@ except ImportError:
 
 levels = ["debug", "info", "critical"]
 
+versions = itertools.count(1)  # filter versions, unique across filters
+
 styles = {
     'debug': {'color': 'white'},
     'info': {'color': 'green'},
@@ -20,53 +27,162 @@ styles = {
 }
 
 
+class Rules(NotifyingList):
+    """ List of (pattern, mode) that tells its filter when it changes. """
+
+    def __init__(self, rules, changed):
+        super().__init__(rules)
+        self.changed = changed
+
+
 class Filter:
+    """ Decides if a path is logged: the first matching rule wins.
+        Verdicts are cached per path until rules or default change.
+    """
 
     def __init__(self, rules=[], default=True):
+        self.cache = {}
+        self.version = 0  # new one from versions on every change
         self.rules = rules
         self.default = default
 
+    @property
+    def rules(self):
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        self._rules = Rules(rules, self.invalidate)
+        self.invalidate()
+
+    @property
+    def default(self):
+        return self._default
+
+    @default.setter
+    def default(self, default):
+        self._default = default
+        self.invalidate()
+
+    def invalidate(self):
+        self.compiled = [(re.compile(translate(pattern)).match, mode)
+                         for pattern, mode in self._rules]
+        self.cache.clear()
+        self.version = next(versions)
+
     def test(self, path):
-        path = ".".join(path)
-        for pattern, mode in self.rules:
-            if fnmatch(path, pattern):
-                return mode
-        return self.default
+        """ path is a tuple of names. """
+        try:
+            return self.cache[path]
+        except KeyError:
+            pass
+        name = ".".join(path)
+        for match, mode in self.compiled:
+            if match(name):
+                break
+        else:
+            mode = self._default
+        self.cache[path] = mode
+        return mode
 
 logfilter = Filter()
+timestamp = Timestamp("%Y/%m/%d %H:%M:%S ")
 
 
 class Log:
+    """ Logger for a path of names, log.a.b is the logger for a child path.
+
+        Loggers are immutable and interned: a child is created once and
+        then found in the parent's __dict__, so any thread can use them
+        and a call does not allocate anything until it is logged.
+    """
     file = sys.stderr
+    throttle = None          # ratelimit.Throttle
+    lock = threading.Lock()  # serializes creation of children
 
-    def __init__(self, prefix=[], file=None):
+    def __init__(self, prefix=[], file=None, throttle=None):
         if isinstance(prefix, str):
             prefix = prefix.split('.')
-        self.prefix = prefix
-        self.path = copy(self.prefix)
+        init = super().__setattr__
+        init('prefix', tuple(prefix))
+        init('path', self.prefix)
+        init('_name', '.'.join(self.path))
+        init('_style', styles.get(self.path[-1] if self.path else '',
+                                  styles['debug']))
+        init('_urgent', self.path[-1:] in [('error',), ('critical',)])
+        init('_verdict', (None, False))  # (logfilter.version, verdict)
         if file:
-            self.file = file
+            init('file', file)
+        if throttle:
+            init('throttle', throttle)
 
-    def __getattr__(self, name):
-        self.path.append(name)
-        return self
+    def __setattr__(self, name, value):
+        raise AttributeError("loggers are immutable")
 
-    def __call__(self, *args, **kwargs):
-        self.log(*args, **kwargs)
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        with self.lock:
+            child = self.__dict__.get(name)
+            if not child:
+                child = Log(self.path + (name,), self.__dict__.get('file'),
+                            self.__dict__.get('throttle'))
+                self.__dict__[name] = child
+        return child
+
+    def __call__(self, *msg):
+        # fast path for suppressed calls, the verdict is up to date
+        version, verdict = self._verdict
+        if verdict or version != logfilter.version:
+            self.log(*msg)
+
+    def enabled(self):
+        version, verdict = self._verdict
+        if version != logfilter.version:
+            verdict = logfilter.test(self.path)
+            super().__setattr__('_verdict', (logfilter.version, verdict))
+        return verdict
 
     def log(self, *msg):
-        if logfilter.test(self.path):
-            path = '.'.join(self.path)
-            msg = " ".join(str(m) for m in msg)
-            ts = time.strftime("%Y/%m/%d %H:%M:%S ")
-            msg = ts + path + ': ' + msg
-            if self.file == sys.stderr:
-                style = styles.get(self.path[-1], styles['debug'])
-                print(colored(msg, **style), file=self.file)
-            else:
-                print(msg, file=self.file)
-        self.path = copy(self.prefix)
-
+        """ Functions in msg are called only if the message is logged:
+            log.debug("state:", lambda: expensive_dump()).
+        """
+        if not self.enabled():
+            return
+        throttle = self.throttle
+        if throttle:
+            # rate check before any formatting or lazy argument
+            template = msg[0] if msg and type(msg[0]) is str else None
+            key = throttle.admit((self._name, template), self._write,
+                                 depth=2)
+            if key is None:
+                return
+        text = " ".join(str(m() if type(m) is FunctionType else m)
+                        for m in msg)
+        if throttle:
+            notes = throttle.notes(key, (self._name, text), self._write)
+            if notes is None:
+                return
+            for emit, note in notes:
+                emit(note)
+        self._write(text)
+
+    def _write(self, msg):
+        file = self.file
+        if hasattr(file, 'record'):
+            # structured output (logring), no formatting
+            file.record(self._name, self.path[-1], msg)
+            return
+        msg = timestamp() + self._name + ': ' + msg
+        if file == sys.stderr:
+            msg = colored(msg, **self._style)
+        if not self._urgent:
+            file.write(msg + '\n')  # one write per record
+        elif hasattr(file, 'write_now'):
+            file.write_now(msg + '\n')  # queued file, skips the queue
+        else:
+            file.write(msg + '\n')
+            file.flush()
 
 if __name__ == '__main__':
     log = Log(["test"])
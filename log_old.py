@@ -4,10 +4,15 @@ from datetime import datetime
 from functools import partial
 
 import traceback
+import weakref
 import string
 import syslog
+import time
 import sys
 
+from useful.notifylist import NotifyingList
+from useful.tscache import Timestamp
+
 try:
     from termcolor import colored
 except ImportError:
@@ -17,10 +22,22 @@ except ImportError:
 
 TBLIMIT = 6
 nothing = lambda *x,**y: None
-outputs = []  # default outputs
 priority = ['debug', 'info', 'notice', 'error', 'critical']
 default = 1  # info
-loggers = []
+loggers = weakref.WeakSet()
+
+
+class Outputs(NotifyingList):
+  """ List of outputs. Loggers group outputs by level, the groups
+      are rebuilt when `changes` moves: on any change of an Outputs
+      list or of an output's level.
+  """
+  changes = 0
+
+  def changed(self):
+    Outputs.changes += 1
+
+outputs = Outputs()  # default outputs
 
 def str2lvl(lvl):
   if isinstance(lvl,str):
@@ -50,8 +67,17 @@ class Output:
   def __init__(self, lvl=0):
     self.lvl = lvl
 
+  @property
+  def lvl(self):
+    return self._lvl
+
+  @lvl.setter
+  def lvl(self, lvl):
+    self._lvl = lvl
+    Outputs.changes += 1
+
   def write(self, msg, lvl=0):
-    if lvl >= self.lvl:
+    if lvl >= self._lvl:
       self.writer(msg, lvl=lvl)
 
   def writer(self, msg, lvl=None):
@@ -60,6 +86,17 @@ class Output:
     if category in self.styles:
       style = self.styles[category]
     print(colored(msg, **style), file=sys.stderr)
+
+  def record(self, name, lvl, msg, text, fields=None):
+    """ Called by Log with the record parts and the formatted text.
+        Structured outputs override this, others write the text.
+    """
+    self.write(text, lvl=lvl)
+
+  def writemany(self, records):
+    """ Write a batch of (msg, lvl) records. """
+    for msg, lvl in records:
+      self.writer(msg, lvl=lvl)
 outputs += [Output()]
 
 
@@ -77,35 +114,126 @@ class FileOutput(Output):
     self.fd = open(path, 'a', buffering=1)
     super().__init__(lvl)
 
-  def writer(self, msg):
+  def writer(self, msg, lvl=None):
     self.fd.write(msg+'\n')
 
+  def writemany(self, records):
+    self.fd.write(''.join(msg+'\n' for msg, lvl in records))
+
+
+class Format:
+  """ Record template parsed once.
+
+      Fields given as constants (the logger name) are substituted right
+      away, {tstamp:<strftime spec>} fields are rendered by a Timestamp
+      cache. What is left is a plain template for str.format_map().
+  """
+  def __init__(self, fmt, **consts):
+    self.stamps = {}         # field name in template -> Timestamp
+    self.datetime = False    # template needs the datetime object
+    template = []
+    for literal, field, spec, conv in string.Formatter().parse(fmt):
+      template.append(literal.replace('{', '{{').replace('}', '}}'))
+      if field is None:
+        continue
+      if field in consts:
+        value = consts[field]
+        value = {'r': repr, 's': str, 'a': ascii}.get(conv, lambda v: v)(value)
+        value = format(value, spec)
+        template.append(value.replace('{', '{{').replace('}', '}}'))
+        continue
+      if field == 'tstamp' and not conv:
+        # same text as datetime's __format__, microseconds need no cache
+        spec = spec or '%Y-%m-%d %H:%M:%S.%f'
+        resolution = 1e-6 if '%f' in spec else 1
+        field = 'tstamp%d' % len(self.stamps)
+        self.stamps[field] = Timestamp(spec, resolution)
+        spec = ''
+      elif field.startswith('tstamp'):
+        self.datetime = True  # {tstamp.year} and alike
+      template.append('{' + field + ('!'+conv if conv else '') +
+                      (':'+spec if spec else '') + '}')
+    self.template = ''.join(template)
+
+  def __call__(self, **fields):
+    now = time.time()
+    for field, stamp in self.stamps.items():
+      fields[field] = stamp(now)
+    if self.datetime:
+      fields['tstamp'] = datetime.fromtimestamp(now)
+    return self.template.format_map(fields)
+
 
 class Log:
   def __init__(self, name, lvl=None,
-               fmt="{tstamp:%H:%M:%S} {cat} {name}: {msg}", outputs=outputs):
-    global loggers
-    global default
+               fmt="{tstamp:%H:%M:%S} {cat} {name}: {msg}", outputs=outputs,
+               throttle=None):
     if lvl is None:
       lvl = default
     self.lvl = lvl
-    self.fmt = fmt
     self.name = name
-    self.format = string.Formatter().format
+    self.fmt = fmt
     self.outputs = outputs
-    loggers += [self]
+    self.grouped = (None, None, [])  # (Outputs.changes, copy, groups)
+    self.throttle = throttle      # ratelimit.Throttle
+    loggers.add(self)
+
+  @property
+  def lvl(self):
+    return self._lvl
+
+  @lvl.setter
+  def lvl(self, lvl):
+    """ Bind log.<category> for every level: a partial of log()
+        or nothing if the level is below lvl.
+    """
+    lvl = str2lvl(lvl)
+    self._lvl = lvl
+    for i, category in enumerate(priority):
+      self.__dict__[category] = partial(self.log, lvl=i) if i >= lvl \
+                                else nothing
+
+  def by_level(self):
+    """ Outputs that accept records of each level. """
+    changes, copy, groups = self.grouped
+    outputs = self.outputs
+    # changes of a plain list are not counted, compare it with a copy
+    if changes != Outputs.changes or \
+       copy is not None and copy != outputs:
+      groups = [[o for o in outputs if o.lvl <= lvl]
+                for lvl in range(len(priority))]
+      copy = None if isinstance(outputs, Outputs) else list(outputs)
+      self.grouped = (Outputs.changes, copy, groups)
+    return groups
+
+  @property
+  def fmt(self):
+    return self._fmt
+
+  @fmt.setter
+  def fmt(self, fmt):
+    self._fmt = fmt
+    self.format = Format(fmt, name=self.name)
 
   def set_verbosity(self, lvl):
-    self.lvl = str2lvl(lvl)
+    self.lvl = lvl
 
   @classmethod
   def set_global_level(cls, lvl):
     set_global_level(lvl)
 
-  def log(self, msg, *args, lvl=0, style=None, tb=None):
-    if lvl < self.lvl:
+  def log(self, msg, *args, lvl=0, style=None, tb=None, fields=None):
+    if lvl < self._lvl:
       return
 
+    throttle = self.throttle
+    if throttle:
+      # rate check first, records over the rate are not even expanded
+      emit = partial(self.emit, lvl=lvl)
+      key = throttle.admit((self.name, msg), emit)
+      if key is None:
+        return
+
     # expand msg
     if args:
       try:
@@ -114,9 +242,17 @@ class Log:
         # fallback
         msg = " ".join([msg]+list(args))
 
-    tstamp = datetime.today()
-    msg = self.format(self.fmt, msg=msg, cat=priority[lvl],
-                        tstamp=tstamp, name=self.name)
+    if throttle:
+      notes = throttle.notes(key, (self.name, lvl, msg), emit)
+      if notes is None:
+        return
+      for emit, note in notes:
+        emit(note)
+    self.emit(msg, lvl, tb, fields)
+
+  def emit(self, msg, lvl, tb=None, fields=None):
+    """ Format expanded msg and pass it to outputs. """
+    text = self.format(msg=msg, cat=priority[lvl])
 
     if tb:
       if sys.exc_info() != (None, None, None):
@@ -124,10 +260,11 @@ class Log:
       else:
         tb = traceback.format_stack(limit=TBLIMIT)
         tb = "".join(tb)
-      msg += "\n" + tb
+      text += "\n" + tb
+      fields = dict(fields or {}, tb=tb)
 
-    for output in self.outputs:
-        output.write(msg, lvl=lvl)
+    for output in self.by_level()[lvl]:
+      output.record(self.name, lvl, msg, text, fields)
 
 
   def __call__(self, *args, **kwargs):
@@ -135,15 +272,11 @@ class Log:
 
 
   def __getattr__(self, category, **kwargs):
-    if category in priority:
-      lvl = priority.index(category)
-      if lvl < self.lvl:
-        return nothing
-    else:
-      print("unknown category %s" % category, file=sys.stderr)
-      lvl = 1
-
-    return partial(self.log, lvl=lvl, **kwargs)
+    # known categories are bound by lvl setter
+    if category.startswith('_'):
+      raise AttributeError(category)
+    print("unknown category %s" % category, file=sys.stderr)
+    return partial(self.log, lvl=1, **kwargs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+""" Log aggregation for multiprocess programs using log_old.
+
+    Every process ships its records over a multiprocessing queue,
+    a collector thread in the parent orders them by time and writes
+    them to the real outputs in batches:
+
+      agg = logagg.aggregate()        # in the parent, before the pool
+      pool = Pool(initializer=logagg.attach, initargs=(agg.queue,))
+
+    With the fork start method attach() is not even needed,
+    children inherit the shipping output.
+"""
+from queue import Empty
+import multiprocessing
+import threading
+import atexit
+import time
+import os
+
+from useful import log_old
+from useful.log_old import Output
+
+
+class ShipOutput(Output):
+  """ Sends records to the collector, does not write anything. """
+  def __init__(self, queue, lvl=0):
+    super().__init__(lvl)
+    self.queue = queue
+
+  def record(self, name, lvl, msg, text, fields=None):
+    self.queue.put((time.time(), name, lvl, msg, text, fields))
+
+  def writer(self, msg, lvl=0):
+    self.record("", lvl, msg, msg)
+
+
+def attach(queue, outputs=log_old.outputs):
+  """ Make loggers of this process ship their records to queue. """
+  outputs[:] = [ShipOutput(queue)]
+
+
+class Aggregator:
+  """ Collects records from all processes and writes them to outputs.
+
+      Records are gathered for `window` seconds, sorted by the time
+      they were made and handed over to each output as one batch.
+  """
+  def __init__(self, outputs=log_old.outputs, window=0.05, context=None):
+    context = context if context else multiprocessing.get_context()
+    self.queue = context.Queue()
+    self.shared = outputs                  # list loggers refer to
+    self.outputs = list(outputs)           # where records go in the end
+    self.window = window
+    self.pid = os.getpid()
+    self.written = 0
+    self.closed = False
+    self.thread = threading.Thread(target=self.run, name="log collector",
+                                   daemon=True)
+
+  def start(self):
+    attach(self.queue, self.shared)
+    self.thread.start()
+    atexit.register(self.close)
+    return self
+
+  def collect(self):
+    """ Records of one window. """
+    records = []
+    deadline = None
+    while True:
+      timeout = None if deadline is None else deadline - time.monotonic()
+      if timeout is not None and timeout <= 0:
+        break
+      try:
+        record = self.queue.get(timeout=timeout)
+      except Empty:
+        break
+      if record is None:
+        self.closed = True
+        break
+      records.append(record)
+      if deadline is None:
+        deadline = time.monotonic() + self.window
+    return records
+
+  def write(self, records):
+    records.sort(key=lambda r: r[0])  # stable: same-time records keep order
+    for output in self.outputs:
+      accepted = [r for r in records if r[2] >= output.lvl]
+      if type(output).record is Output.record:
+        # plain text output, one write for the whole batch
+        output.writemany([(text, lvl) for _, _, lvl, _, text, _
+                          in accepted])
+      else:
+        for _, name, lvl, msg, text, fields in accepted:
+          output.record(name, lvl, msg, text, fields)
+    self.written += len(records)
+
+  def run(self):
+    while not self.closed:
+      records = self.collect()
+      if records:
+        self.write(records)
+
+  def close(self):
+    """ Write what is left and give outputs back to this process. """
+    if os.getpid() != self.pid or not self.thread.is_alive():
+      return
+    self.queue.put(None)
+    self.thread.join()
+    records = []
+    while not self.queue.empty():
+      records.append(self.queue.get())
+    self.write([r for r in records if r])
+    self.shared[:] = self.outputs
+    atexit.unregister(self.close)
+
+
+def aggregate(outputs=log_old.outputs, window=0.05, context=None):
+  """ Start aggregation, call it in the parent before making workers. """
+  return Aggregator(outputs, window, context).start()
+
+
+def _work(n):
+  log = log_old.Log("worker%d" % n)
+  for i in range(100):
+    log.info("record %d", i)
+  return n
+
+
+if __name__ == '__main__':
+  from multiprocessing import Pool
+  agg = aggregate()
+  with Pool(4, initializer=attach, initargs=(agg.queue,)) as pool:
+    pool.map(_work, range(4))
+  agg.close()
+  print("records written:", agg.written)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+""" Microbenchmarks for log and log_old, numbers are ns per call. """
+from datetime import datetime
+from timeit import Timer
+import string
+import time
+import io
+
+from useful.log import Log, logfilter
+from useful.log_old import Format
+from useful.tscache import Timestamp
+import useful.log_old as log_old
+
+
+def percall(stmt, number=100000, repeat=5, **names):
+  """ Best of repeat runs, ns per call. """
+  timer = Timer(stmt, globals=names)
+  return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def calls():
+  """ Enabled vs disabled log calls. """
+  log = Log("bench", file=io.StringIO())
+  saved = logfilter.rules
+  logfilter.rules = [("bench.quiet.*", False)] + \
+                    [("other%d.*" % i, False) for i in range(20)]
+  try:
+    names = dict(log=log, data=list(range(100)))
+    return {
+      "disabled": percall("log.quiet.debug('x')", **names),
+      "disabled, lazy arg":
+        percall("log.quiet.debug('data', lambda: sorted(data))", **names),
+      "enabled": percall("log.loud.debug('x')", number=10000, **names),
+    }
+  finally:
+    logfilter.rules = saved
+
+
+class Null(log_old.Output):
+  def writer(self, msg, lvl=None):
+    pass
+
+
+def records():
+  """ Record rendering: uncached (as it used to be) vs cached. """
+  fmt = log_old.Log.__init__.__defaults__[1]
+  names = dict(time=time, datetime=datetime, formatter=string.Formatter(),
+               fmt=fmt, stamp=Timestamp("%Y/%m/%d %H:%M:%S "),
+               format=Format(fmt, name="bench"),
+               old=log_old.Log("bench", lvl=0, outputs=[Null()]))
+  return {
+    "strftime": percall("time.strftime('%Y/%m/%d %H:%M:%S ')", **names),
+    "Timestamp": percall("stamp()", **names),
+    "Formatter.format": percall(
+      "formatter.format(fmt, msg='x', cat='info', name='bench',"
+      " tstamp=datetime.today())", **names),
+    "Format": percall("format(msg='x', cat='info')", **names),
+    "log_old record": percall("old.info('x %s', 1)", **names),
+  }
+
+
+if __name__ == '__main__':
+  for name, ns in calls().items():
+    print("{:<20} {:>10.0f} ns".format(name, ns))
+  print()
+  for name, ns in records().items():
+    print("{:<20} {:>10.0f} ns {:>10.0f} records/s".format(name, ns, 1e9/ns))
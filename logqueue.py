@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+""" Non-blocking log output: records are queued and written
+    in batches by a background thread.
+"""
+from collections import deque
+import threading
+import traceback
+import atexit
+import sys
+
+from useful.log_old import Output, str2lvl
+
+BLOCK = "block"              # wait for the writer to make space
+DROP_OLDEST = "drop-oldest"  # forget the oldest queued record
+DROP_NEW = "drop-new"        # forget the record being logged
+
+
+class LogQueue:
+  """ Bounded queue with a writer thread.
+
+      put() is an append to a deque, no lock is taken unless the queue
+      is full (or the policy is DROP_OLDEST, to count drops). The
+      writer wakes up when the queue gets its first record (or every
+      `interval` seconds), takes up to `batch` records and passes them
+      to write() in one call. Remaining records are written on exit.
+  """
+  def __init__(self, write, maxsize=10000, overflow=BLOCK, batch=1000,
+               interval=0.1, name="log writer"):
+    assert overflow in (BLOCK, DROP_OLDEST, DROP_NEW), \
+      "unknown overflow policy %s" % overflow
+    self.write = write      # callable that takes a list of records
+    self.maxsize = maxsize
+    self.overflow = overflow
+    self.batch = batch
+    self.interval = interval
+    maxlen = maxsize if overflow == DROP_OLDEST else None
+    self.records = deque(maxlen=maxlen)
+    self.lock = threading.Lock()          # counters
+    self.writing = threading.Lock()       # one drain at a time
+    self.space = threading.Condition()    # for BLOCK policy
+    self.wakeup = threading.Event()
+    self.closed = False
+    self.written = 0
+    self.dropped_oldest = 0
+    self.dropped_new = 0
+    self.errors = 0
+    self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+    self.thread.start()
+    atexit.register(self.close)
+
+  def put(self, record, flush=False):
+    """ Queue record, with flush=True write it and everything queued
+        before it now, whatever the overflow policy.
+    """
+    records = self.records
+    if self.closed:
+      self.write([record])
+      return
+    if flush:
+      self.drain([record])
+      return
+    if self.overflow == DROP_OLDEST:
+      with self.lock:
+        if len(records) == self.maxsize:
+          self.dropped_oldest += 1  # deque's maxlen pushes it out
+        records.append(record)
+    elif len(records) < self.maxsize or self.full():
+      records.append(record)
+    else:
+      return
+    if len(records) == 1:
+      self.wakeup.set()
+
+  def full(self):
+    """ Apply overflow policy, False if the record must be dropped. """
+    if self.overflow == DROP_NEW:
+      with self.lock:
+        self.dropped_new += 1
+      return False
+    with self.space:
+      while len(self.records) >= self.maxsize and not self.closed:
+        self.wakeup.set()
+        self.space.wait(self.interval)
+    return True
+
+  def drain(self, last=()):
+    """ Write everything that is queued, then records in last. """
+    records = self.records
+    with self.writing:
+      while records:
+        batch = []
+        with self.lock:  # so that put() knows if the deque is full
+          try:
+            for _ in range(self.batch):
+              batch.append(records.popleft())
+          except IndexError:
+            pass
+        self.commit(batch)
+      if last:
+        self.commit(list(last))
+
+  def commit(self, batch):
+    try:
+      self.write(batch)
+      self.written += len(batch)
+    except Exception:
+      # the writer thread must survive a broken output
+      self.errors += 1
+      if self.errors == 1:
+        traceback.print_exc(file=sys.__stderr__)
+    if self.overflow == BLOCK:
+      with self.space:
+        self.space.notify_all()
+
+  def run(self):
+    while not self.closed:
+      self.wakeup.wait(self.interval)
+      self.wakeup.clear()
+      self.drain()
+
+  def flush(self):
+    """ Write queued records now, in the calling thread. """
+    self.drain()
+
+  def close(self):
+    """ Stop the writer thread and write what is left. """
+    if self.closed:
+      return
+    self.closed = True
+    self.wakeup.set()
+    if self.thread is not threading.current_thread():
+      self.thread.join()
+    self.drain()
+    atexit.unregister(self.close)
+
+  def stats(self):
+    return dict(queued=len(self.records), written=self.written,
+                dropped_oldest=self.dropped_oldest,
+                dropped_new=self.dropped_new, errors=self.errors)
+
+
+class QueuedOutput(Output):
+  """ log_old output that hands records to other outputs
+      in a background thread:
+
+        outputs[:] = [QueuedOutput(Output(), FileOutput("app.log"))]
+
+      Records of flush_lvl and above are written before log() returns.
+  """
+  def __init__(self, *outputs, lvl=0, flush_lvl='error', **kwargs):
+    super().__init__(lvl)
+    self.outputs = outputs
+    self.flush_lvl = str2lvl(flush_lvl)
+    self.queue = LogQueue(self.writemany, **kwargs)
+
+  def writer(self, msg, lvl=0):
+    self.queue.put((msg, lvl), flush=lvl >= self.flush_lvl)
+
+  def writemany(self, records):
+    for output in self.outputs:
+      output.writemany([r for r in records if r[1] >= output.lvl])
+
+  def flush(self):
+    self.queue.flush()
+
+  def close(self):
+    self.queue.close()
+
+
+class QueuedFile:
+  """ File for log.Log(file=...) that is written in a background thread.
+      Error and critical records are written before log() returns.
+  """
+  def __init__(self, file=sys.stderr, **kwargs):
+    self.file = file
+    self.queue = LogQueue(self.writemany, **kwargs)
+
+  def write(self, data):
+    self.queue.put(data)
+    return len(data)
+
+  def write_now(self, data):
+    """ Write data and what is queued before returning, log.Log
+        uses it for error and critical records.
+    """
+    self.queue.put(data, flush=True)
+    return len(data)
+
+  def writemany(self, chunks):
+    self.file.write(''.join(chunks))
+    self.file.flush()
+
+  def flush(self):
+    self.queue.flush()
+
+  def close(self):
+    self.queue.close()
+
+
+if __name__ == '__main__':
+  import time
+  import io
+
+  class SlowFile(io.StringIO):
+    def write(self, data):
+      time.sleep(0.01)  # disk stall
+      return super().write(data)
+
+  out = QueuedFile(SlowFile(), overflow=DROP_OLDEST, maxsize=1000)
+  start = time.perf_counter()
+  for i in range(100000):
+    out.write("record %d\n" % i)
+  elapsed = time.perf_counter() - start
+  out.close()
+  print("100k records in {:.0f}ms".format(elapsed*1000), out.queue.stats())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+""" Structured log records in a preallocated memory-mapped ring file.
+
+    File layout: 64 byte header, then `capacity` bytes of records.
+    Every record starts with a fixed 32 byte header, followed by the
+    logger name, the message and optional JSON fields, padded to 8 bytes.
+    Records never wrap around the end of the file, the gap is taken by
+    a padding record. Offsets in the header only grow, position in the
+    file is offset % capacity:
+
+      head  where the next record goes
+      tail  oldest record that was not overwritten yet
+"""
+from collections import namedtuple
+from fnmatch import fnmatch
+import threading
+import fcntl
+import struct
+import json
+import mmap
+import time
+import os
+
+from useful.log_old import Output, priority
+
+MAGIC = b'ULRING1\0'
+# magic version - capacity head tail seq
+HEADER = struct.Struct('<8sIIQQQQ16x')
+# length kind level name msg fields seq ts, name..fields are lengths
+RECORD = struct.Struct('<IBBHIIQd')
+PAD, DATA = 0, 1
+DROPPED = b'{"dropped": "fields do not fit into the ring"}'
+HEAD_AT = 24                            # offset of head, tail, seq
+POINTERS = struct.Struct('<QQQ')
+
+Record = namedtuple('Record', 'seq tstamp level name msg fields')
+
+
+def align(n):
+  return n + 7 & ~7
+
+
+class RingFile:
+  """ Writer. An existing ring of the same size is continued.
+
+      Head, tail and seq are kept in the object, so by default there
+      must be one writer per file. With shared=True every append()
+      takes an flock on the file and reloads them from the header,
+      several processes can write then, at the cost of two syscalls
+      per record.
+  """
+  def __init__(self, path, capacity=16*1024*1024, shared=False):
+    capacity = align(capacity)
+    assert capacity >= RECORD.size + len(DROPPED), "ring is too small"
+    size = HEADER.size + capacity
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      if shared:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+      fresh = os.fstat(fd).st_size != size
+      if fresh:
+        os.ftruncate(fd, size)
+      self.map = mmap.mmap(fd, size)
+      magic, _, _, cap = HEADER.unpack_from(self.map)[:4]
+      if fresh or magic != MAGIC or cap != capacity:
+        HEADER.pack_into(self.map, 0, MAGIC, 1, 0, capacity, 0, 0, 0)
+    finally:
+      if shared:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+      else:
+        os.close(fd)
+    self.fd = fd if shared else None  # kept open for flock
+    self.capacity = capacity
+    self.head, self.tail, self.seq = POINTERS.unpack_from(self.map, HEAD_AT)
+    self.lock = threading.Lock()
+
+  def evict(self, end):
+    """ Move tail so that records up to end fit. """
+    tail, limit = self.tail, end - self.capacity
+    while tail < limit:
+      tail += struct.unpack_from('<I', self.map,
+                                 HEADER.size + tail % self.capacity)[0]
+    if tail != self.tail:
+      self.tail = tail
+      # readers check tail to see if a record was overwritten under them
+      struct.pack_into('<Q', self.map, HEAD_AT + 8, tail)
+
+  def append(self, level, name, msg, fields=None, tstamp=None):
+    """ Write one record. Never fails because of its size: fields
+        that take more than half of the ring are replaced with
+        DROPPED, then name and message are truncated to fit.
+    """
+    if tstamp is None:
+      tstamp = time.time()
+    room = self.capacity - RECORD.size
+    fields = json.dumps(fields, default=str).encode() if fields else b''
+    if len(fields) > room // 2:
+      fields = DROPPED
+    room -= len(fields)
+    name = name.encode()[:min(room, 0xffff)]
+    msg = msg.encode()[:room - len(name)]
+    length = align(RECORD.size + len(name) + len(msg) + len(fields))
+    with self.lock:
+      if self.fd is not None:
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        self.head, self.tail, self.seq = \
+          POINTERS.unpack_from(self.map, HEAD_AT)
+      try:
+        self.put(length, level, name, msg, fields, tstamp)
+      finally:
+        if self.fd is not None:
+          fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+  def put(self, length, level, name, msg, fields, tstamp):
+    """ Write a record that fits, under the locks. """
+    head, cap, base = self.head, self.capacity, HEADER.size
+    left = cap - head % cap
+    if left < length:
+      self.evict(head + left)
+      struct.pack_into('<IB', self.map, base + head % cap, left, PAD)
+      head += left
+    self.evict(head + length)
+    pos = base + head % cap
+    RECORD.pack_into(self.map, pos, length, DATA, level, len(name),
+                     len(msg), len(fields), self.seq, tstamp)
+    pos += RECORD.size
+    self.map[pos:pos+len(name)] = name
+    pos += len(name)
+    self.map[pos:pos+len(msg)] = msg
+    pos += len(msg)
+    self.map[pos:pos+len(fields)] = fields
+    self.head = head + length
+    self.seq += 1
+    # publish: readers see the record only after head moves
+    POINTERS.pack_into(self.map, HEAD_AT, self.head, self.tail, self.seq)
+
+  def record(self, name, level, msg):
+    """ log.Log calls this instead of formatting the record. Its
+        name ends with the level ("svc.error"), which is cut off.
+    """
+    if level in priority:
+      self.append(priority.index(level), name[:-len(level)-1], msg)
+    else:
+      self.append(0, name, msg)
+
+  def flush(self):
+    self.map.flush()
+
+  def close(self):
+    self.map.close()
+    if self.fd is not None:
+      os.close(self.fd)
+
+
+class RingOutput(Output):
+  """ log_old output that writes structured records to a RingFile. """
+  def __init__(self, path, lvl=0, capacity=16*1024*1024):
+    super().__init__(lvl)
+    self.ring = RingFile(path, capacity)
+
+  def record(self, name, lvl, msg, text, fields=None):
+    if lvl >= self.lvl:
+      self.ring.append(lvl, name, msg, fields)
+
+  def writer(self, msg, lvl=0):
+    self.ring.append(lvl, "", msg)
+
+  def writemany(self, records):
+    for msg, lvl in records:
+      self.writer(msg, lvl)
+
+
+class RingReader:
+  """ Reads records from a ring file, possibly while it is written.
+
+      The reader remembers its offset, so follow() picks up only new
+      records. If the writer laps the reader, it skips to the oldest
+      record left and counts skipped records in `lost`.
+  """
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, _, _, capacity, head, tail, seq = HEADER.unpack_from(self.map)
+    assert magic == MAGIC, "%s is not a log ring" % path
+    self.capacity = capacity
+    self.offset = tail
+    self.expect = self.first_seq(tail, head, seq)  # seq of the next record
+    self.lost = 0
+
+  def first_seq(self, offset, head, seq):
+    """ seq of the first record from offset on, seq (the next one
+        to be written) if there is none.
+    """
+    while offset < head:
+      pos = HEADER.size + offset % self.capacity
+      length, kind = struct.unpack_from('<IB', self.map, pos)
+      if kind == DATA:
+        return RECORD.unpack_from(self.map, pos)[6]
+      offset += length
+    return seq
+
+  def pointers(self):
+    """ Return (head, tail, seq) as the writer left them. """
+    return POINTERS.unpack_from(self.map, HEAD_AT)
+
+  def read(self):
+    """ Records written since the last call. """
+    head, tail, _ = self.pointers()
+    records = []
+    while True:
+      self.offset = max(self.offset, tail)  # skip what was overwritten
+      if self.offset >= head:
+        break
+      pos = HEADER.size + self.offset % self.capacity
+      length, kind = struct.unpack_from('<IB', self.map, pos)
+      record = None
+      if kind == DATA:
+        _, _, level, nlen, mlen, flen, seq, ts = \
+          RECORD.unpack_from(self.map, pos)
+        data = self.map[pos+RECORD.size:pos+RECORD.size+nlen+mlen+flen]
+        record = (seq, ts, level, data, nlen, mlen, flen)
+      tail = self.pointers()[1]
+      if tail > self.offset:
+        continue  # overwritten while reading
+      self.offset += length
+      if record:
+        seq, ts, level, data, nlen, mlen, flen = record
+        if seq > self.expect:
+          self.lost += seq - self.expect
+        self.expect = seq + 1
+        records.append(Record(seq, ts, level,
+                              data[:nlen].decode(errors='replace'),
+                              data[nlen:nlen+mlen].decode(errors='replace'),
+                              json.loads(data[nlen+mlen:]) if flen else None))
+    return records
+
+  def scan(self, level=0, name='*'):
+    """ Records from the oldest on, level and name (a glob) filter them. """
+    level = level if isinstance(level, int) else priority.index(level)
+    return [r for r in self.read() if r.level >= level
+            and fnmatch(r.name, name)]
+
+  def follow(self, level=0, name='*', interval=0.1):
+    """ Generator of new records, like tail -f. """
+    while True:
+      records = self.scan(level, name)
+      yield from records
+      if not records:
+        time.sleep(interval)
+
+  def close(self):
+    self.map.close()
+
+
+def format_record(r):
+  tstamp = time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(r.tstamp))
+  level = priority[r.level] if r.level < len(priority) else r.level
+  text = "{} {} {}: {}".format(tstamp, level, r.name, r.msg)
+  return text + " " + json.dumps(r.fields) if r.fields else text
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description="Print records of a log ring.")
+  parser.add_argument('path')
+  parser.add_argument('-f', '--follow', action='store_true',
+                      help="wait for new records")
+  parser.add_argument('-l', '--level', default='debug', choices=priority,
+                      help="minimal level")
+  parser.add_argument('-n', '--name', default='*',
+                      help="logger name, glob pattern")
+  parser.add_argument('--json', action='store_true',
+                      help="one JSON object per line")
+  args = parser.parse_args()
+  reader = RingReader(args.path)
+  scan = reader.follow if args.follow else reader.scan
+  try:
+    for r in scan(args.level, args.name):
+      print(json.dumps(r._asdict()) if args.json else format_record(r),
+            flush=args.follow)
+  except KeyboardInterrupt:
+    pass
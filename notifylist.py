@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+""" List that tells when it changes. """
+
+
+class NotifyingList(list):
+  """ List that calls self.changed() after every change. """
+
+  def changed(self):
+    pass
+
+
+def _notify(name):
+  method = getattr(list, name)
+  def wrapper(self, *args):
+    result = method(self, *args)
+    self.changed()
+    return result
+  wrapper.__name__ = name
+  return wrapper
+
+for _name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+              'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse']:
+  setattr(NotifyingList, _name, _notify(_name))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+""" Rate limiting and duplicate collapsing for log records. """
+import threading
+import atexit
+import time
+import sys
+
+from useful.timer import Timer
+
+NOTHING = ()
+
+
+class TokenBucket:
+  """ Allows `rate` events per second on average and bursts
+      of up to `burst` events.
+  """
+  def __init__(self, rate, burst=None, clock=time.monotonic):
+    self.rate = rate
+    self.burst = burst if burst else max(rate, 1)
+    self.clock = clock
+    self.tokens = self.burst
+    self.last = clock()
+
+  def take(self):
+    now = self.clock()
+    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+    self.last = now
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return True
+    return False
+
+
+def callsite(depth):
+  """ (file, line) of the code depth frames above the caller. """
+  frame = sys._getframe(depth + 1)
+  return frame.f_code.co_filename, frame.f_lineno
+
+
+class Throttle:
+  """ Decides which records of a logger get through.
+
+      With `rate` set every key (message template, or call site with
+      by="site") gets a TokenBucket, records over the limit are dropped
+      and counted. The next record that passes tells how many were
+      dropped. With `collapse` a record equal to the previous one is
+      dropped, a "last message repeated N times" note goes out before
+      the next different one. Notes that are still pending go out
+      `flush_after` seconds after the first repeat or drop, and at exit.
+
+      Notes come as (emit, text): emit is what the caller passed with
+      the record the note is about, emit(text) writes it with that
+      record's logger and level.
+
+      Loggers call admit() before they format a record, so a record
+      over the rate costs nothing, then notes() with the formatted
+      record. check() does both.
+  """
+  def __init__(self, rate=None, burst=None, by="msg", collapse=True,
+               maxkeys=10000, flush_after=2, clock=time.monotonic):
+    assert by in ("msg", "site"), "unknown key %s" % by
+    self.rate = rate
+    self.burst = burst
+    self.by = by
+    self.collapse = collapse
+    self.maxkeys = maxkeys
+    self.flush_after = flush_after
+    self.clock = clock
+    self.buckets = {}     # key -> TokenBucket
+    self.dropped = {}     # key -> [records dropped since one passed, emit]
+    self.last = None      # previous record that passed
+    self.last_emit = None  # and how to write notes about it
+    self.repeats = 0      # times it was repeated since
+    self.suppressed = 0   # total, over the rate
+    self.collapsed = 0    # total, duplicates
+    self.lock = threading.Lock()
+    self.timer = None     # flushes notes, started on first use
+    atexit.register(self.flush)
+
+  def key(self, template, depth):
+    return callsite(depth + 1) if self.by == "site" else template
+
+  def allow(self, key, emit):
+    """ False if record with key is over the rate. """
+    with self.lock:
+      bucket = self.buckets.get(key)
+      if not bucket:
+        if len(self.buckets) >= self.maxkeys:
+          # messages with variable text, do not grow forever
+          self.buckets.clear()
+          self.dropped.clear()
+        bucket = self.buckets[key] = TokenBucket(self.rate, self.burst,
+                                                 self.clock)
+      if bucket.take():
+        return True
+      dropped = self.dropped.get(key)
+      if dropped:
+        dropped[0] += 1
+      else:
+        self.dropped[key] = [1, emit]
+        self.arm()
+      self.suppressed += 1
+      return False
+
+  def admit(self, template, emit, depth=1):
+    """ None if the record must be dropped, otherwise the key
+        to pass to notes(). template is the unformatted message,
+        depth is how many frames above the caller is the call site.
+    """
+    if not self.rate:
+      return template
+    key = self.key(template, depth + 1)
+    return key if self.allow(key, emit) else None
+
+  def notes(self, key, record, emit):
+    """ None if record is a duplicate, otherwise notes to emit
+        before it.
+    """
+    with self.lock:
+      if self.collapse:
+        if record == self.last:
+          self.repeats += 1
+          self.collapsed += 1
+          if self.repeats == 1:
+            self.arm()
+          return None
+        notes = self.pending()
+        self.last, self.last_emit = record, emit
+      else:
+        notes = NOTHING
+      dropped = self.dropped.pop(key, None) if self.rate else None
+    if not dropped:
+      return notes
+    return list(notes) + [(emit, "%d similar messages suppressed"
+                                 % dropped[0])]
+
+  def check(self, template, record, emit, depth=1):
+    """ admit() and notes() in one call. """
+    key = self.admit(template, emit, depth + 1)
+    if key is None:
+      return None
+    return self.notes(key, record, emit)
+
+  def pending(self):
+    """ Note about repeats so far, resets the count. Under the lock. """
+    repeats, self.repeats = self.repeats, 0
+    if repeats:
+      return [(self.last_emit,
+               "last message repeated %d times" % repeats)]
+    return NOTHING
+
+  def arm(self):
+    """ Make flush() run soon. Under the lock. """
+    if not self.flush_after:
+      return
+    if not self.timer:
+      self.timer = Timer(self.flush, None)
+      self.timer.start()
+    self.timer.restart(self.flush_after)
+
+  def flush(self):
+    """ Write pending notes: repeats and drops not reported yet. """
+    if self.timer:
+      self.timer.cancel()
+    with self.lock:
+      notes = list(self.pending())
+      dropped, self.dropped = self.dropped, {}
+    notes += [(emit, "%d similar messages suppressed" % count)
+              for count, emit in dropped.values()]
+    for emit, note in notes:
+      emit(note)
+
+  def stats(self):
+    return dict(suppressed=self.suppressed, collapsed=self.collapsed,
+                pending={key: count for key, (count, _)
+                         in self.dropped.items()},
+                repeats=self.repeats)
@@ -1,48 +1,306 @@
 #!/usr/bin/env python3
 from threading import Thread
-import select
+import threading
+import math
+import time
 import sys
-import os
 
+BITS = 8
+SLOTS = 1 << BITS
+MASK = SLOTS - 1
 
-class Timer(Thread):
-  def __init__(self, cb, timeout):
+SKIP = "skip"        # periodic timer late by more than a period drops the
+                     # missed calls and keeps to its schedule
+CATCHUP = "catchup"  # ... makes every missed call, back to back
+
+
+def next_due(due, timeout, now, missed=SKIP):
+  """ When a periodic timer that was due at `due` is due next,
+      and how many calls it skips.
+  """
+  due += timeout
+  if due > now or missed == CATCHUP:
+    return due, 0
+  skipped = int((now - due) // timeout) + 1
+  return due + skipped * timeout, skipped
+
+
+class Wheel:
+  """ Hierarchical timing wheel, runs any number of timers on one thread.
+
+      Time is counted in ticks. Level k has SLOTS slots of SLOTS**k ticks,
+      a timer sits in the lowest level its deadline fits in and moves down
+      when the wheel reaches its slot. Adding and removing a timer is O(1).
+      The thread sleeps until the next occupied tick.
+  """
+  def __init__(self, tick=0.001, levels=4, clock=time.monotonic):
+    self.tick = tick
+    self.clock = clock
+    self.epoch = clock()
+    self.now = 0           # next tick to process, earlier ones are done
+    self.levels = [[set() for _ in range(SLOTS)] for _ in range(levels)]
+    self.count = 0         # timers in the wheel
+    self.wake = None       # tick the thread sleeps until
+    self.cond = threading.Condition()
+    self.thread = None
+
+  def ticks(self, when):
+    """ Tick of clock time `when`, rounded up. """
+    return math.ceil((when - self.epoch) / self.tick)
+
+  def place(self, timer):
+    deadline = max(timer.deadline, self.now)
+    delta = deadline - self.now
+    top = len(self.levels) - 1
+    level = 0
+    while level < top and delta >> BITS * (level + 1):
+      level += 1
+    if delta >> BITS * (top + 1):
+      # too far: park in the last slot of the top level, it comes back
+      index = ((self.now >> BITS * top) - 1) & MASK
+    else:
+      index = (deadline >> BITS * level) & MASK
+    slot = self.levels[level][index]
+    slot.add(timer)
+    timer.slot = slot
+
+  def add(self, timer, timeout):
+    """ (Re)schedule timer to fire in timeout seconds. """
+    self.add_at(timer, self.clock() + timeout)
+
+  def add_at(self, timer, when):
+    """ (Re)schedule timer to fire at clock time `when`. """
+    with self.cond:
+      if timer.slot is not None:
+        timer.slot.discard(timer)
+      else:
+        self.count += 1
+      timer.deadline = self.ticks(when)
+      self.place(timer)
+      if not self.thread:
+        self.thread = Thread(target=self.run, name="timer wheel", daemon=True)
+        self.thread.start()
+      if self.wake is None or timer.deadline < self.wake:
+        self.cond.notify()
+
+  def remove(self, timer):
+    with self.cond:
+      if timer.slot is not None:
+        timer.slot.discard(timer)
+        timer.slot = None
+        self.count -= 1
+
+  def advance(self):
+    """ Process ticks up to the current time, return timers to fire. """
+    due = []
+    target = int((self.clock() - self.epoch) / self.tick)
+    levels = self.levels
+    while self.now <= target and self.count:
+      now = self.now
+      if not now & MASK:
+        # boundary: bring timers of the next slots one level down
+        for level in range(len(levels) - 1, 0, -1):
+          if not now & ((1 << BITS * level) - 1):
+            index = (now >> BITS * level) & MASK
+            slot, levels[level][index] = levels[level][index], set()
+            for timer in slot:
+              self.place(timer)
+      index = now & MASK
+      if levels[0][index]:
+        slot, levels[0][index] = levels[0][index], set()
+        for timer in slot:
+          timer.slot = None
+        self.count -= len(slot)
+        due.extend(slot)
+      self.now += 1
+    if not self.count:
+      self.now = max(self.now, target + 1)
+    return due
+
+  def next_tick(self):
+    """ Tick the thread needs to wake up at, None if there are no timers. """
+    if not self.count:
+      return None
+    now = self.now
+    if not now & MASK:
+      return now  # cascade pending, level 0 is not filled yet
+    level0 = self.levels[0]
+    for tick in range(now, (now | MASK) + 1):
+      if level0[tick & MASK]:
+        return tick
+    return (now | MASK) + 1  # time to cascade
+
+  def run(self):
+    while True:
+      with self.cond:
+        due = self.advance()
+        if not due:
+          self.wake = self.next_tick()
+          timeout = None
+          if self.wake is not None:
+            timeout = max(0, self.epoch + self.wake*self.tick - self.clock())
+          self.cond.wait(timeout)
+          self.wake = None
+          continue
+      for timer in due:
+        timer.fire()
+
+
+_wheel = None
+_wheel_lock = threading.Lock()
+
+
+def wheel():
+  """ Wheel shared by all Timers, created on first use. """
+  global _wheel
+  with _wheel_lock:
+    if not _wheel:
+      _wheel = Wheel()
+    return _wheel
+
+
+class Timer:
+  """ Calls cb every timeout seconds, on the shared timer wheel.
+
+      Same interface as ThreadTimer: start(), restart(), cancel() and
+      abort(), but no thread and no pipe per timer. Calls are scheduled
+      on absolute deadlines, a slow cb does not shift the ones after it.
+      `missed` tells what to do when calls are late by more than a
+      period: SKIP them or CATCHUP.
+  """
+  def __init__(self, cb, timeout, wheel=None, missed=SKIP):
+    assert missed in (SKIP, CATCHUP), "unknown mode %s" % missed
+    self.cb = cb
+    self.timeout = timeout
+    self.wheel = wheel
+    self.missed = missed
+    self.due = None       # clock time of the next call
+    self.deadline = None  # same in wheel ticks
+    self.slot = None      # set in the wheel the timer is in
+    self.skipped = 0      # calls dropped in SKIP mode
+    self.started = False
+    self.aborted = threading.Event()
+
+  def start(self):
+    if not self.wheel:
+      self.wheel = wheel()
+    self.started = True
+    self.arm()
+
+  def arm(self):
+    if not self.started or self.aborted.is_set():
+      return
+    if self.timeout is None:
+      self.wheel.remove(self)
+    else:
+      self.due = self.wheel.clock() + self.timeout
+      self.wheel.add_at(self, self.due)
+
+  def restart(self, timeout=None):
+    """ Restart timer. Cheap, calling it often just moves the deadline. """
+    if timeout:
+      self.timeout = timeout
+    self.arm()
+
+  def cancel(self):
+    """ Canceled, no events will fire until restarted. """
+    self.timeout = None
+    self.arm()
+
+  def abort(self):
+    """ Stop timer completely. """
+    self.cancel()
+    self.aborted.set()
+
+  def fire(self):
+    if self.timeout is None or self.slot is not None:
+      return  # canceled or restarted after it was due
+    due = self.due
+    try:
+      self.cb()
+    except Exception as err:
+      print("error from cb (ignored): %s" % err, file=sys.stderr)
+    if self.slot is not None or self.due != due or self.timeout is None \
+       or self.aborted.is_set():
+      return  # restarted, canceled or aborted by cb
+    self.due, skipped = next_due(due, self.timeout, self.wheel.clock(),
+                                 self.missed)
+    self.skipped += skipped
+    self.wheel.add_at(self, self.due)
+
+  def is_alive(self):
+    return self.started and not self.aborted.is_set()
+
+  def join(self, timeout=None):
+    """ Wait until the timer is aborted. """
+    self.aborted.wait(timeout)
+
+
+class ThreadTimer(Thread):
+  """ Timer with a thread of its own. Like Timer it keeps to absolute
+      deadlines, restart() only moves the deadline and wakes the thread
+      when the new one is earlier than what it sleeps until.
+  """
+  def __init__(self, cb, timeout, missed=SKIP, clock=time.monotonic):
     super().__init__(daemon=True)
+    assert missed in (SKIP, CATCHUP), "unknown mode %s" % missed
     self.cb = cb
     self.timeout = timeout
-    read_fd, write_fd = os.pipe()
-    self.read_fd = read_fd
-    self.write_fd = write_fd
+    self.missed = missed
+    self.clock = clock
+    self.due = None      # clock time of the next call
+    self.wake = None     # what the thread sleeps until
+    self.skipped = 0
+    self.aborted = False
+    self.cond = threading.Condition()
+
+  def start(self):
+    with self.cond:
+      if self.due is None and self.timeout is not None:
+        self.due = self.clock() + self.timeout
+    super().start()
+
+  def reschedule(self, due):
+    with self.cond:
+      self.due = due
+      if due is not None and (self.wake is None or due < self.wake):
+        self.cond.notify()
 
   def restart(self, timeout=None):
     """ Restart timer. """
     if timeout:
       self.timeout = timeout
-    os.write(self.write_fd, b'r')
+    if self.timeout is not None:
+      self.reschedule(self.clock() + self.timeout)
 
   def cancel(self):
     """ Canceled, no events will fire until restarted. """
-    os.write(self.write_fd, b'c')
+    self.timeout = None
+    self.reschedule(None)
 
   def abort(self):
     """ Stop timer completely, timer thread will quit. """
-    os.write(self.write_fd, b'a')
+    with self.cond:
+      self.aborted = True
+      self.cond.notify()
 
   def run(self):
     while True:
-      ready_fds = select.select([self.read_fd], [], [],
-                                self.timeout)
-      if self.read_fd in ready_fds[0]:
-        mode = os.read(self.read_fd, 1)
-        if mode == b'r':    # restart
-          continue
-        elif mode == b'c':  # cancel pending events
-          self.timeout = None
-          continue
-        elif mode == b'a':  # abort
+      with self.cond:
+        while not self.aborted and \
+              (self.due is None or self.due > self.clock()):
+          self.wake = self.due
+          self.cond.wait(None if self.due is None
+                         else self.due - self.clock())
+        self.wake = None
+        if self.aborted:
           break
-        else:
-          raise Exception("unknown mode %s" % mode)
+        if self.timeout is None:
+          self.due = None  # canceled while due
+          continue
+        self.due, skipped = next_due(self.due, self.timeout, self.clock(),
+                                     self.missed)
+        self.skipped += skipped
       try:
         self.cb()
       except Exception as err:
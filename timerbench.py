@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+""" Timer benchmarks: 100k active timers on one thread, cadence
+    of periodic timers.
+"""
+import threading
+import random
+import time
+
+from useful.timer import Timer, ThreadTimer, Wheel, SKIP, CATCHUP
+
+
+def scale(count=100000, spread=1.0, delay=0.5):
+  """ Start count one-shot timers due in [delay, delay+spread) seconds,
+      restart and cancel them, then let them fire. Returns rates of
+      operations per second and how late timers fired.
+  """
+  wheel = Wheel()
+  late = []
+  def make(timer_box):
+    def cb():
+      timer = timer_box[0]
+      late.append(time.monotonic() - timer.due)
+      timer.cancel()  # one-shot
+    return cb
+
+  timers = []
+  for i in range(count):
+    box = []
+    timer = Timer(make(box), None, wheel=wheel)
+    box.append(timer)
+    timers.append(timer)
+  timeouts = [delay + random.random() * spread for _ in range(count)]
+
+  start = time.perf_counter()
+  for timer, timeout in zip(timers, timeouts):
+    timer.timeout = timeout
+    timer.due = time.monotonic() + timeout
+    timer.start()
+  started = count / (time.perf_counter() - start)
+
+  start = time.perf_counter()
+  for timer, timeout in zip(timers, timeouts):
+    timer.due = time.monotonic() + timeout
+    timer.restart(timeout)
+  restarted = count / (time.perf_counter() - start)
+
+  cancel = timers[::10]
+  start = time.perf_counter()
+  for timer in cancel:
+    timer.cancel()
+  canceled = len(cancel) / (time.perf_counter() - start)
+  threads = threading.active_count()
+
+  deadline = time.monotonic() + delay + spread + 1
+  while len(late) < count - len(cancel) and time.monotonic() < deadline:
+    time.sleep(0.05)
+  late.sort()
+  return dict(count=count, threads=threads, started=started,
+              restarted=restarted, canceled=canceled, fired=len(late),
+              median=late[len(late)//2], p99=late[len(late)*99//100],
+              max=late[-1])
+
+
+def cadence(cls=Timer, missed=SKIP, period=0.01, calls=300, work=0.004,
+            stall=0.035):
+  """ A sampling loop: cb every period seconds that works for `work`
+      seconds and once stalls for `stall`. Returns how far the last
+      call is from where the schedule says, and how many calls made it.
+  """
+  stamps = []
+  done = threading.Event()
+  def cb():
+    stamps.append(time.monotonic())
+    n = len(stamps)
+    time.sleep(stall if n == calls // 2 else work)
+    if n >= calls:
+      timer.cancel()
+      done.set()
+  timer = cls(cb, period, missed=missed)
+  timer.start()
+  done.wait(calls * period * 2)
+  timer.abort()
+  first, last = stamps[0], stamps[-1]
+  slots = round((last - first) / period)
+  return dict(calls=len(stamps), skipped=timer.skipped,
+              drift=last - first - slots * period,
+              duration=last - first)
+
+
+def restarts(cls=Timer, count=100000, timeout=1):
+  """ restart() calls per second on one timer, it must not fire. """
+  fired = []
+  timer = cls(lambda: fired.append(1), timeout)
+  timer.start()
+  start = time.perf_counter()
+  for i in range(count):
+    timer.restart()
+  rate = count / (time.perf_counter() - start)
+  timer.abort()
+  return rate, len(fired)
+
+
+if __name__ == '__main__':
+  r = scale()
+  print("{count} timers, {threads} threads in the process".format(**r))
+  print("start:   {started:>10.0f}/s".format(**r))
+  print("restart: {restarted:>10.0f}/s".format(**r))
+  print("cancel:  {canceled:>10.0f}/s".format(**r))
+  print("fired {fired}, late by median {median:.4f}s, p99 {p99:.4f}s,"
+        " max {max:.4f}s".format(**r))
+  print()
+  print("10ms sampling loop, 4ms of work per call, one 35ms stall:")
+  for cls in (Timer, ThreadTimer):
+    for missed in (SKIP, CATCHUP):
+      r = cadence(cls, missed)
+      print("{:<11} {:<7}  {calls} calls in {duration:.3f}s, {skipped} skipped,"
+            " off schedule by {drift:+.4f}s".format(cls.__name__, missed, **r))
+  for cls in (Timer, ThreadTimer):
+    rate, fired = restarts(cls)
+    print("{:<11} restart: {:>10.0f}/s, fired {}".format(cls.__name__, rate,
+                                                          fired))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+""" Timestamp formatting for log records. """
+from datetime import datetime
+import time
+
+
+class Timestamp:
+  """ strftime() that reformats only when time moves to the next tick.
+
+      resolution is the tick in seconds. Records within one tick get the
+      same text, so it should not be finer than what fmt shows.
+  """
+  def __init__(self, fmt="%Y/%m/%d %H:%M:%S", resolution=1,
+               clock=time.time):
+    self.fmt = fmt
+    self.resolution = resolution
+    self.clock = clock
+    self.cached = (None, "")  # (tick, text), replaced in one go
+
+  def __call__(self, now=None):
+    if now is None:
+      now = self.clock()
+    tick = now // self.resolution
+    cached = self.cached
+    if cached[0] == tick:
+      return cached[1]
+    text = datetime.fromtimestamp(now).strftime(self.fmt)
+    self.cached = (tick, text)
+    return text
+
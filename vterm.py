@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+""" Headless terminal: escape sequence generator and a virtual screen. """
+from contextlib import contextmanager
+import re
+
+# CSI, charset selection or a two-character escape
+ESCAPE = re.compile(r'\x1b(?:\[([0-?]*)[ -/]*([@-~])|[()][0-~]|([0-~]))')
+COLORS = "black red green yellow blue magenta cyan white".split()
+
+
+class Screen:
+  """ In-memory screen: a grid of (char, style) cells.
+
+      Understands the escapes libgui and blessings emit for
+      xterm-like terminals. It is also a file-like object, every
+      write() is counted so output cost can be measured.
+  """
+  blank = (' ', ())
+
+  def __init__(self, width=80, height=24):
+    self.width = width
+    self.height = height
+    self.writes = 0      # number of write() calls
+    self.bytes = 0       # bytes written, UTF-8 encoded
+    self.clear()
+
+  def clear(self):
+    self.cells = [[self.blank]*self.width for _ in range(self.height)]
+    self.x = self.y = 0
+    self.style = ()      # SGR parameters in effect
+    self.saved = (0, 0)  # cursor saved by "\x1b7"
+
+  def resize(self, width, height):
+    self.width = width
+    self.height = height
+    self.clear()
+
+  def reset_stats(self):
+    self.writes = self.bytes = 0
+
+  def write(self, data):
+    self.writes += 1
+    self.bytes += len(data.encode())
+    pos = 0
+    for m in ESCAPE.finditer(data):
+      self.put(data[pos:m.start()])
+      pos = m.end()
+      params, final, short = m.groups()
+      if final:
+        self.csi(params, final)
+      elif short == '7':
+        self.saved = (self.x, self.y)
+      elif short == '8':
+        self.x, self.y = self.saved
+    self.put(data[pos:])
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def put(self, text):
+    for ch in text:
+      if ch == '\n':
+        self.x = 0
+        self.newline()
+      elif ch == '\r':
+        self.x = 0
+      else:
+        if self.x >= self.width:  # autowrap
+          self.x = 0
+          self.newline()
+        self.cells[self.y][self.x] = (ch, self.style)
+        self.x += 1
+
+  def newline(self):
+    if self.y == self.height - 1:
+      self.cells.pop(0)
+      self.cells.append([self.blank]*self.width)
+    else:
+      self.y += 1
+
+  def csi(self, params, final):
+    if params.startswith('?'):
+      return  # private modes: cursor visibility, alternate screen
+    args = [int(p) if p else 0 for p in params.split(';')] if params else []
+    arg = args[0] if args else 0
+    if final in 'Hf':
+      row = args[0] if args else 1
+      col = args[1] if len(args) > 1 else 1
+      self.move(max(col, 1) - 1, max(row, 1) - 1)
+    elif final == 'G':
+      self.move(max(arg, 1) - 1, self.y)
+    elif final == 'd':
+      self.move(self.x, max(arg, 1) - 1)
+    elif final == 'A':
+      self.move(self.x, self.y - max(arg, 1))
+    elif final == 'B':
+      self.move(self.x, self.y + max(arg, 1))
+    elif final == 'C':
+      self.move(self.x + max(arg, 1), self.y)
+    elif final == 'D':
+      self.move(self.x - max(arg, 1), self.y)
+    elif final == 'J' and arg == 2:
+      self.cells = [[self.blank]*self.width for _ in range(self.height)]
+    elif final == 'K':
+      row = self.cells[self.y]
+      row[self.x:] = [self.blank]*(self.width - self.x)
+    elif final == 'm':
+      style = self.style if args else ()
+      for a in args:
+        if a == 0:
+          style = ()
+        elif a not in style:
+          style += (a,)
+      self.style = style
+
+  def move(self, x, y):
+    self.x = min(max(x, 0), self.width - 1)
+    self.y = min(max(y, 0), self.height - 1)
+
+  def text(self):
+    """ Screen content as a list of strings. """
+    return [''.join(ch for ch, _ in row) for row in self.cells]
+
+  def style_at(self, x, y):
+    """ SGR parameters of the cell. """
+    return self.cells[y][x][1]
+
+  def __str__(self):
+    return "\n".join(self.text())
+
+
+class VirtualTerminal:
+  """ Drop-in for the parts of blessings.Terminal that libgui uses.
+      Emits plain ANSI escapes, output goes to a Screen.
+  """
+  normal = '\x1b[m'
+  clear = '\x1b[H\x1b[2J'
+  bold = '\x1b[1m'
+  reverse = inverse = '\x1b[7m'
+  underline = '\x1b[4m'
+  save = '\x1b7'
+  restore = '\x1b8'
+  enter_fullscreen = '\x1b[?1049h'
+  exit_fullscreen = '\x1b[?1049l'
+
+  def __init__(self, width=80, height=24, stream=None):
+    self.stream = stream if stream else Screen(width, height)
+    self.width = width
+    self.height = height
+
+  def resize(self, width, height):
+    """ Pretend the terminal window was resized. """
+    self.width = width
+    self.height = height
+    if isinstance(self.stream, Screen):
+      self.stream.resize(width, height)
+
+  def move(self, y, x):
+    return '\x1b[%d;%dH' % (y + 1, x + 1)
+
+  def move_x(self, x):
+    return '\x1b[%dG' % (x + 1)
+
+  def move_y(self, y):
+    return '\x1b[%dd' % (y + 1)
+
+  @contextmanager
+  def location(self, x=None, y=None):
+    self.stream.write(self.save)
+    if x is not None and y is not None:
+      self.stream.write(self.move(y, x))
+    try:
+      yield
+    finally:
+      self.stream.write(self.restore)
+
+  @contextmanager
+  def fullscreen(self):
+    self.stream.write(self.enter_fullscreen)
+    try:
+      yield
+    finally:
+      self.stream.write(self.exit_fullscreen)
+
+  def __getattr__(self, name):
+    # colors: red, on_red, bright_red
+    for prefix, base in [('on_bright_', 100), ('bright_', 90),
+                         ('on_', 40), ('', 30)]:
+      if name.startswith(prefix) and name[len(prefix):] in COLORS:
+        return '\x1b[%dm' % (base + COLORS.index(name[len(prefix):]))
+    raise AttributeError(name)
+
+
+if __name__ == '__main__':
+  term = VirtualTerminal(20, 3)
+  screen = term.stream
+  screen.write(term.move(1, 2) + term.red + term.reverse + "hello" + term.normal)
+  print(screen)
+  print("style of 'h':", screen.style_at(2, 1), "writes:", screen.writes)